@@ -0,0 +1,402 @@
+# IMPORTER
+import argparse
+import hmac
+import json
+import re
+import sqlite3
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from urllib.parse import parse_qs, urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import Config
+from llm_handler import LLMHandler
+from prompt import get_system_prompt, get_feedback_hint
+from model_router import AUTO_MODEL, resolve_route
+from metrics import start_metrics_server
+from prompt_registry import PromptRegistry
+from feedback_db import (
+    ShardRouter, UnknownTenantError, get_feedback_summary_all, export_feedback_json_all, export_feedback_csv_all, save_routing_decision, save_feedback, get_feedback_summary, save_message, load_messages,
+    create_or_update_conversation, get_all_conversations, delete_conversation
+)
+
+RATING_LIMITS = {"thumbs": (-1, 1), "stars": (1, 5)}
+TEMPERATURE_LIMITS = (0.0, 2.0)
+# Antal konversationer vars frysta feedbacktips hålls i minnet
+FEEDBACK_HINT_CACHE_SIZE = 10000
+
+
+class ApiError(Exception):
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+# RESURSER - DELADE MELLAN FÖRFRÅGNINGAR
+class ApiState:
+
+    def __init__(self, db_path: str, shard_dir: str = None):
+        self.router = ShardRouter(shard_dir=shard_dir, default_path=db_path, allowed_tenants=Config.ALLOWED_TENANTS)
+        self.llm_handler = LLMHandler()
+        self._registries = {}
+        self._feedback_hints = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Schemat är redan skapat; varje förfrågan får en egen lätt anslutning till sin hyresgästs shard
+    def connect(self, tenant: str) -> sqlite3.Connection:
+        try:
+            return self.router.connect(tenant)
+        except UnknownTenantError as e:
+            raise ApiError(404, str(e))
+        except ValueError as e:
+            raise ApiError(400, str(e))
+
+    def get_prompt_registry(self, tenant: str) -> PromptRegistry:
+        path = self.router.shard_path(tenant)
+        with self._lock:
+            registry = self._registries.get(path)
+            if registry is None:
+                registry = self._registries[path] = PromptRegistry()
+            return registry
+
+    # Tipset fryses per konversation (som i main.py) så att systemprompten är byte-stabil mellan turer
+    # och sammanfattningen inte räknas om vid varje anrop
+    def feedback_hint(self, conn, tenant: str, conversation_id: str) -> str:
+        key = (self.router.shard_path(tenant), conversation_id)
+        with self._lock:
+            if key in self._feedback_hints:
+                self._feedback_hints.move_to_end(key)
+                return self._feedback_hints[key]
+        hint = get_feedback_hint(get_feedback_summary(conn))
+        with self._lock:
+            hint = self._feedback_hints.setdefault(key, hint)
+            while len(self._feedback_hints) > FEEDBACK_HINT_CACHE_SIZE:
+                self._feedback_hints.popitem(last=False)
+        return hint
+
+
+# HTTP - FÖRFRÅGNINGSHANTERARE
+class ApiRequestHandler(BaseHTTPRequestHandler):
+    server_version = "AIChatAPI/1.0"
+    protocol_version = "HTTP/1.1"
+
+    routes = [
+        ("GET", re.compile(r"^/health$"), "handle_health"),
+        ("GET", re.compile(r"^/conversations$"), "handle_list_conversations"),
+        ("POST", re.compile(r"^/conversations$"), "handle_create_conversation"),
+        ("GET", re.compile(r"^/conversations/([\w-]+)/messages$"), "handle_get_messages"),
+        ("DELETE", re.compile(r"^/conversations/([\w-]+)$"), "handle_delete_conversation"),
+        ("POST", re.compile(r"^/conversations/([\w-]+)/chat$"), "handle_chat"),
+        ("POST", re.compile(r"^/conversations/([\w-]+)/feedback$"), "handle_feedback"),
+        ("GET", re.compile(r"^/feedback/summary$"), "handle_feedback_summary"),
+        ("GET", re.compile(r"^/admin/feedback/summary$"), "handle_admin_feedback_summary"),
+        ("GET", re.compile(r"^/admin/feedback/export$"), "handle_admin_feedback_export"),
+    ]
+
+    @property
+    def state(self) -> ApiState:
+        return self.server.state
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def _dispatch(self, method: str) -> None:
+        url = urlsplit(self.path)
+        path = url.path.rstrip("/") or "/"
+        self.query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        self.stream_started = False
+        conn = None
+        try:
+            for route_method, pattern, handler_name in self.routes:
+                match = pattern.match(path)
+                if match and route_method == method:
+                    # Adminvyer går över alla shards och behöver ingen egen anslutning, men en admin-token
+                    if handler_name.startswith("handle_admin_"):
+                        self._require_admin()
+                    else:
+                        self.tenant = self.headers.get("X-Tenant") or self.query.get("tenant") or Config.DEFAULT_TENANT
+                        conn = self.state.connect(self.tenant)
+                    getattr(self, handler_name)(conn, *match.groups())
+                    return
+            raise ApiError(404, "Okänd resurs.")
+        except ApiError as e:
+            self.close_connection = True
+            self._send_error(e.status, e.message)
+        except Exception as e:
+            self.close_connection = True
+            self._send_error(500, f"Internt fel: {e}")
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def _require_admin(self) -> None:
+        if not Config.ADMIN_TOKEN:
+            raise ApiError(404, "Okänd resurs.")
+        auth = self.headers.get("Authorization") or ""
+        token = auth[7:] if auth.startswith("Bearer ") else ""
+        if not hmac.compare_digest(token.encode("utf-8"), Config.ADMIN_TOKEN.encode("utf-8")):
+            raise ApiError(401, "Admin-token saknas eller är fel.")
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        try:
+            body = json.loads(self.rfile.read(length))
+        except json.JSONDecodeError:
+            raise ApiError(400, "Ogiltig JSON.")
+        if not isinstance(body, dict):
+            raise ApiError(400, "Förväntade ett JSON-objekt.")
+        return body
+
+    def _send_json(self, status: int, data) -> None:
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Efter att SSE-huvudena skickats kan inget nytt HTTP-svar skrivas; avsluta strömmen med ett fel-event
+    def _send_error(self, status: int, message: str) -> None:
+        if not self.stream_started:
+            self._send_json(status, {"error": message})
+            return
+        try:
+            self._send_event("error", {"error": message})
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except OSError:
+            pass
+
+    def _start_stream(self) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self.stream_started = True
+
+    def _send_event(self, event: str, data: dict) -> None:
+        payload = f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+        self.wfile.write(f"{len(payload):x}\r\n".encode("ascii") + payload + b"\r\n")
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+    # KONVERSATIONER
+    def handle_health(self, conn) -> None:
+        self._send_json(200, {"status": "ok"})
+
+    def handle_list_conversations(self, conn) -> None:
+        self._send_json(200, get_all_conversations(conn))
+
+    def handle_create_conversation(self, conn) -> None:
+        conversation_id = str(uuid.uuid4())
+        create_or_update_conversation(conn, conversation_id)
+        self._send_json(201, {"id": conversation_id})
+
+    def handle_get_messages(self, conn, conversation_id: str) -> None:
+        self._send_json(200, load_messages(conn, conversation_id))
+
+    def handle_delete_conversation(self, conn, conversation_id: str) -> None:
+        delete_conversation(conn, conversation_id)
+        self._send_json(200, {"deleted": conversation_id})
+
+    # CHATT - STRÖMMANDE SVAR (SSE)
+    def handle_chat(self, conn, conversation_id: str) -> None:
+        body = self._read_json()
+        text = (body.get("message") or "").strip()
+        if not text:
+            raise ApiError(400, "Fältet 'message' saknas.")
+        # Okända modeller och temperaturer skulle ge en ny cachad klient och nya metrikserier per värde
+        model_name = body.get("model") or Config.DEFAULT_MODEL
+        if model_name != AUTO_MODEL and model_name not in Config.AVAILABLE_MODELS:
+            raise ApiError(400, f"Okänd modell. Tillåtna: {', '.join([AUTO_MODEL] + Config.AVAILABLE_MODELS)}.")
+        try:
+            temperature = float(body.get("temperature", Config.DEFAULT_TEMPERATURE))
+        except (TypeError, ValueError):
+            raise ApiError(400, "Ogiltig temperatur.")
+        low, high = TEMPERATURE_LIMITS
+        if not low <= temperature <= high:
+            raise ApiError(400, f"Temperaturen måste ligga mellan {low} och {high}.")
+        temperature = round(temperature, 2)
+
+        # Samma standardvärden för prompt och routing, så att båda ser samma ämne och nivå
+        subject = body.get("subject") or "Programmering"
+        difficulty = body.get("difficulty") or "Medel"
+        saved_prompts = {}
+        if body.get("saved_prompt"):
+            saved_prompts = self.state.get_prompt_registry(self.tenant).prompts(conn)
+        system_prompt = get_system_prompt(
+            selected_saved_prompt=body.get("saved_prompt") or "Ingen prompt vald",
+            saved_prompts=saved_prompts,
+            subject=subject,
+            difficulty=difficulty,
+            feedback_hint=self.state.feedback_hint(conn, self.tenant, conversation_id)
+        )
+
+        timestamp = datetime.now().strftime("%H:%M:%S")
+        create_or_update_conversation(conn, conversation_id)
+        user_message_id = save_message(conn, conversation_id=conversation_id, role="user", content=text, timestamp=timestamp)
+        # LLMHandler läser roll/innehåll direkt ur raderna via en vy; ingen extra lista byggs
+        history = load_messages(conn, conversation_id)
+
+        routing = resolve_route(model_name, text, subject, difficulty, len(history) - 1)
+        model_name = routing["model"]
+
+        self._start_stream()
+        self._send_event("start", {"conversation_id": conversation_id, "user_message_id": user_message_id, "model": model_name})
+
+        try:
+            for event in self.state.llm_handler.stream(
+                history,
+                system_message=system_prompt,
+                model_name=model_name,
+                temperature=temperature,
+            ):
+                if event["type"] == "token":
+                    self._send_event("token", {"text": event["text"]})
+                elif event["type"] == "done":
+                    debug = event.get("debug", {})
+                    message_id = save_message(
+                        conn,
+                        conversation_id=conversation_id,
+                        role="assistant",
+                        content=event["text"],
+                        timestamp=datetime.now().strftime("%H:%M:%S")
+                    )
+                    self._log_routing(conn, conversation_id, routing, message_id, debug)
+                    self._send_event("done", {
+                        "message_id": message_id,
+                        "text": event["text"],
+                        "response_time": debug.get("response_time"),
+                        "ttft": debug.get("ttft"),
+                        "token_usage": debug.get("token_usage"),
+                    })
+                elif event["type"] == "error":
+                    self._log_routing(conn, conversation_id, routing, None, event.get("debug", {}))
+                    self._send_event("error", {"error": event.get("error")})
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # Klienten kopplade ner mitt i strömmen; svaret sparas inte
+            self.close_connection = True
+
+    # Både Auto och manuella val loggas, precis som i appen
+    def _log_routing(self, conn, conversation_id: str, routing: dict, message_id, debug: dict) -> None:
+        save_routing_decision(
+            conn,
+            conversation_id=conversation_id,
+            message_id=message_id,
+            mode=routing["mode"],
+            model=routing["model"],
+            score=routing.get("score"),
+            features=routing.get("features"),
+            latency=debug.get("response_time"),
+            ttft=debug.get("ttft"),
+            success=debug.get("success", False)
+        )
+
+    # FEEDBACK
+    def handle_feedback(self, conn, conversation_id: str) -> None:
+        body = self._read_json()
+        rating_type = body.get("rating_type")
+        if rating_type not in RATING_LIMITS:
+            raise ApiError(400, "rating_type måste vara 'thumbs' eller 'stars'.")
+        try:
+            message_id = int(body.get("message_id"))
+            rating_value = int(body.get("rating_value"))
+        except (TypeError, ValueError):
+            raise ApiError(400, "message_id och rating_value måste vara heltal.")
+        low, high = RATING_LIMITS[rating_type]
+        if not low <= rating_value <= high or (rating_type == "thumbs" and rating_value == 0):
+            raise ApiError(400, f"Ogiltigt värde för {rating_type}.")
+
+        messages = load_messages(conn, conversation_id)
+        index = next((i for i, m in enumerate(messages) if m["id"] == message_id), None)
+        if index is None:
+            raise ApiError(404, "Meddelandet finns inte i konversationen.")
+        message = messages[index]
+        saved = save_feedback(
+            conn,
+            conversation_id=conversation_id,
+            message_id=message_id,
+            message_index=index,
+            role=message["role"],
+            rating_type=rating_type,
+            rating_value=rating_value,
+            reason=body.get("reason", ""),
+            message_content=message["content"]
+        )
+        self._send_json(200, {"saved": saved})
+
+    def handle_feedback_summary(self, conn) -> None:
+        self._send_json(200, get_feedback_summary(conn))
+
+    # ADMIN - ALLA HYRESGÄSTER
+    def handle_admin_feedback_summary(self, conn) -> None:
+        self._send_json(200, get_feedback_summary_all(self.state.router))
+
+    def handle_admin_feedback_export(self, conn) -> None:
+        if self.query.get("format", "json") == "csv":
+            body = export_feedback_csv_all(self.state.router)
+            content_type = "text/csv; charset=utf-8"
+        else:
+            body = export_feedback_json_all(self.state.router).encode("utf-8")
+            content_type = "application/json; charset=utf-8"
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+# SERVER - START
+def create_server(host: str, port: int, db_path: str, shard_dir: str = None) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), ApiRequestHandler)
+    server.daemon_threads = True
+    server.state = ApiState(db_path, shard_dir)
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Headless HTTP/SSE-API för AI-läraren.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--db", default="feedback.db", help="Sökväg till SQLite-databasen.")
+    parser.add_argument("--shard-dir", default=Config.SHARD_DIR, help="Katalog med en SQLite-fil per hyresgäst (ersätter --db).")
+    args = parser.parse_args()
+
+    if not Config.OPENAI_API_KEY:
+        parser.error("API-nyckel saknas. Lägg till OPENAI_API_KEY i .env.")
+
+    if Config.ENABLE_METRICS:
+        try:
+            start_metrics_server(Config.METRICS_PORT, Config.METRICS_HOST)
+            print(f"Metrics på http://{Config.METRICS_HOST}:{Config.METRICS_PORT}/metrics")
+        except OSError as e:
+            print(f"Kunde inte starta metrics-server på port {Config.METRICS_PORT}: {e}")
+
+    server = create_server(args.host, args.port, args.db, args.shard_dir)
+    print(f"API lyssnar på http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
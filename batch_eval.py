@@ -0,0 +1,284 @@
+# IMPORTER
+import argparse
+import itertools
+import json
+import math
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List, Optional
+
+from config import Config
+from feedback_db import ConnectionManager, save_eval_result, get_completed_eval_keys, get_eval_results
+from llm_handler import LLMHandler
+from prompt import get_system_prompt
+
+SUBJECTS = ["Programmering", "Språk", "Matematik", "Design", "Dataanalys", "Projektledning"]
+DIFFICULTIES = ["Lätt", "Medel", "Svår"]
+
+
+# FRÅGOR - JSONL MED id, question OCH VALFRIA subject/difficulty
+def load_questions(path: str) -> List[Dict[str, Any]]:
+    questions = []
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            if not item.get("question"):
+                raise ValueError(f"Rad {line_no} saknar 'question'.")
+            item["id"] = str(item.get("id") or line_no)
+            questions.append(item)
+    return questions
+
+
+# Frågor som anger ämne eller nivå körs bara för just det, övriga för hela svepet
+def build_jobs(questions: list, models: list, subjects: list, difficulties: list, completed: set) -> List[Dict[str, Any]]:
+    jobs = []
+    for q in questions:
+        q_subjects = [q["subject"]] if q.get("subject") else subjects
+        q_difficulties = [q["difficulty"]] if q.get("difficulty") else difficulties
+        for model, subject, difficulty in itertools.product(models, q_subjects, q_difficulties):
+            if (q["id"], model, subject, difficulty) in completed:
+                continue
+            jobs.append({"question_id": q["id"], "question": q["question"], "model": model, "subject": subject, "difficulty": difficulty})
+    return jobs
+
+
+# HASTIGHETSBEGRÄNSARE - GEMENSAM FÖR ALLA ARBETARE
+class RateLimiter:
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    # Varje anrop reserverar nästa lediga tidslucka och sover utanför låset
+    def acquire(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+# KÖRNING - ETT ANROP PER JOBB
+def run_job(llm_handler: LLMHandler, limiter: RateLimiter, job: Dict[str, Any], temperature: float) -> Dict[str, Any]:
+    system_message = get_system_prompt(subject=job["subject"], difficulty=job["difficulty"])
+    limiter.acquire()
+    started_at = time.monotonic()
+    result = None
+    for event in llm_handler.stream(
+        [{"role": "user", "content": job["question"]}],
+        system_message=system_message,
+        model_name=job["model"],
+        temperature=temperature,
+    ):
+        if event["type"] in ("done", "error"):
+            result = event
+    debug = result["debug"] if result else {}
+    usage = debug.get("token_usage") or {}
+    return {
+        **job,
+        "answer": result.get("text") if result else None,
+        "success": bool(result) and result["type"] == "done",
+        "error": result.get("error") if result else "Inget svar från modellen.",
+        "latency": debug.get("response_time"),
+        "ttft": debug.get("ttft"),
+        "prompt_tokens": usage.get("prompt_tokens") if isinstance(usage.get("prompt_tokens"), int) else None,
+        "completion_tokens": usage.get("completion_tokens") if isinstance(usage.get("completion_tokens"), int) else None,
+        "started_at": started_at,
+        "finished_at": time.monotonic(),
+    }
+
+
+def run_batch(conn, llm_handler: LLMHandler, jobs: list, *, run_id: str, workers: int, rate: float, temperature: float) -> List[Dict[str, Any]]:
+    limiter = RateLimiter(rate)
+    results = []
+    # Arbetarna anropar bara modellen; all skrivning sker i denna tråd, en rad per klart jobb
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="eval") as executor:
+        futures = [executor.submit(run_job, llm_handler, limiter, job, temperature) for job in jobs]
+        for done, future in enumerate(as_completed(futures), 1):
+            r = future.result()
+            save_eval_result(
+                conn,
+                run_id=run_id,
+                question_id=r["question_id"],
+                model=r["model"],
+                subject=r["subject"],
+                difficulty=r["difficulty"],
+                question=r["question"],
+                answer=r["answer"],
+                success=r["success"],
+                error=None if r["success"] else r["error"],
+                latency=r["latency"],
+                ttft=r["ttft"],
+                prompt_tokens=r["prompt_tokens"],
+                completion_tokens=r["completion_tokens"],
+            )
+            results.append(r)
+            if done % 10 == 0 or done == len(futures):
+                print(f"  {done}/{len(futures)} klara", flush=True)
+    return results
+
+
+# RAPPORT - PER KONFIGURATION
+# Närmaste rang: minsta värdet som minst pct % av mätningarna är mindre än eller lika med
+def percentile(values: list, pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+# Genomströmning per konfiguration räknas över dess eget spann, från första start till sista svar;
+# konfigurationerna körs sammanflätade, så spannen överlappar och summerar inte till totalen
+def summarize(results: list) -> List[Dict[str, Any]]:
+    groups: Dict[tuple, list] = {}
+    for r in results:
+        groups.setdefault((r["model"], r["subject"], r["difficulty"]), []).append(r)
+    rows = []
+    for (model, subject, difficulty), items in sorted(groups.items()):
+        latencies = [r["latency"] for r in items if r["success"] and r["latency"] is not None]
+        ttfts = [r["ttft"] for r in items if r["success"] and r["ttft"] is not None]
+        span = max(r["finished_at"] for r in items) - min(r["started_at"] for r in items)
+        rows.append({
+            "model": model,
+            "subject": subject,
+            "difficulty": difficulty,
+            "n": len(items),
+            "errors": sum(1 for r in items if not r["success"]),
+            "throughput": len(items) / max(span, 1e-9),
+            "p50": percentile(latencies, 50),
+            "p90": percentile(latencies, 90),
+            "p99": percentile(latencies, 99),
+            "ttft_p50": percentile(ttfts, 50),
+        })
+    return rows
+
+
+def _ms(value: Optional[float]) -> str:
+    return f"{value * 1000:8.0f}" if value is not None else f"{'-':>8}"
+
+
+def print_report(rows: list, total: int, wall: float) -> None:
+    print()
+    print(f"Totalt {total} anrop på {wall:.1f} s ({total / max(wall, 1e-9):.2f} anrop/s)")
+    print(f"{'modell':<14} {'ämne':<15} {'nivå':<6} {'n':>4} {'fel':>4} {'anrop/s':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'ttft ms':>8}")
+    for r in rows:
+        print(
+            f"{r['model']:<14} {r['subject']:<15} {r['difficulty']:<6} {r['n']:>4} {r['errors']:>4} "
+            f"{r['throughput']:8.2f} {_ms(r['p50'])} {_ms(r['p90'])} {_ms(r['p99'])} {_ms(r['ttft_p50'])}"
+        )
+
+
+# LOKAL ERSÄTTARE - OPENAI-KOMPATIBEL /chat/completions MED SSE
+class StubCompletionsHandler(BaseHTTPRequestHandler):
+    latency = 0.05
+    answer = "Detta är ett testsvar från den lokala ersättaren."
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_chunk(self, payload: dict) -> None:
+        self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        model = body.get("model", "stub")
+        prompt_tokens = sum(len(str(m.get("content", ""))) // 4 for m in body.get("messages", []))
+        words = self.answer.split(" ")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        time.sleep(self.latency)
+        base = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": int(time.time()), "model": model}
+        for i, word in enumerate(words):
+            text = word if i == 0 else " " + word
+            delta = {"role": "assistant", "content": text} if i == 0 else {"content": text}
+            self._send_chunk({**base, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+        self._send_chunk({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if (body.get("stream_options") or {}).get("include_usage"):
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(words), "total_tokens": prompt_tokens + len(words)}
+            self._send_chunk({**base, "choices": [], "usage": usage})
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def start_stub_server(latency: float, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    handler = type("StubHandler", (StubCompletionsHandler,), {"latency": latency})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="eval-stub", daemon=True).start()
+    return server
+
+
+def _split(value: str) -> List[str]:
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Kör en frågebank genom alla kombinationer av modell, ämne och nivå.")
+    parser.add_argument("questions", help="JSONL med id, question och valfria subject/difficulty.")
+    parser.add_argument("--models", default=Config.DEFAULT_MODEL, help="Kommaseparerade modeller.")
+    parser.add_argument("--subjects", default=",".join(SUBJECTS), help="Kommaseparerade ämnen.")
+    parser.add_argument("--difficulties", default=",".join(DIFFICULTIES), help="Kommaseparerade nivåer.")
+    parser.add_argument("--temperature", type=float, default=Config.DEFAULT_TEMPERATURE)
+    parser.add_argument("--workers", type=int, default=4, help="Max antal samtidiga anrop.")
+    parser.add_argument("--rate", type=float, default=2.0, help="Max anrop per sekund (0 = obegränsat).")
+    parser.add_argument("--db", default="feedback.db", help="Databas där resultaten sparas.")
+    parser.add_argument("--run-id", help="Ange ett tidigare körnings-id för att återuppta.")
+    parser.add_argument("--base-url", default=Config.OPENAI_BASE_URL, help="OpenAI-kompatibel endpoint.")
+    parser.add_argument("--stub", action="store_true", help="Starta en lokal ersättare och kör mot den.")
+    parser.add_argument("--stub-latency", type=float, default=0.05, help="Fördröjning per svar i ersättaren (sekunder).")
+    args = parser.parse_args()
+
+    if args.workers < 1:
+        parser.error("--workers måste vara minst 1.")
+    try:
+        questions = load_questions(args.questions)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    base_url, api_key = args.base_url, None
+    if args.stub:
+        server = start_stub_server(args.stub_latency)
+        base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+        api_key = "sk-stub"
+
+    run_id = args.run_id or f"eval-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    conn = ConnectionManager(args.db).connect()
+    completed = get_completed_eval_keys(conn, run_id)
+    jobs = build_jobs(questions, _split(args.models), _split(args.subjects), _split(args.difficulties), completed)
+    print(f"Körning {run_id}: {len(jobs)} jobb kvar ({len(completed)} redan klara)")
+
+    llm_handler = LLMHandler(base_url=base_url, api_key=api_key)
+    # Bygg klienterna i förväg så att de första jobben inte bär importen och klientbygget
+    for model in {job["model"] for job in jobs}:
+        llm_handler.warm_up(model, args.temperature)
+    started = time.monotonic()
+    results = run_batch(conn, llm_handler, jobs, run_id=run_id, workers=args.workers, rate=args.rate, temperature=args.temperature)
+    finished = time.monotonic()
+
+    print_report(summarize(results), len(results), finished - started)
+    stored = get_eval_results(conn, run_id)
+    print(f"\n{sum(r['success'] for r in stored)}/{len(stored)} lyckade rader sparade i eval_results för {run_id}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# IMPORTER
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Varje läge körs i en egen process så att RSS inte påverkas av det andra lägets allokeringar.
+# "legacy" återskapar den tidigare vägen: en dict per meddelande, en ny historiklista per tur,
+# en kopia med systemprompten i LLMHandler och payloaden kvar i MemoryManager.
+SESSION_SNIPPET = """
+import gc, json, sys, time
+sys.path.insert(0, {app_dir!r})
+from memory_manager import MemoryManager
+from message_store import CONVERSATIONS, as_prompt
+from prompt import build_system_prompt
+
+def rss_kb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+FILLER = "Förklaring med exempel och detaljer. " * {filler}
+system = build_system_prompt("Programmering", "Medel")
+mode, sessions, turns = {mode!r}, {sessions}, {turns}
+
+gc.collect()
+baseline = rss_kb()
+kept = []
+for s in range(sessions):
+    memory = MemoryManager()
+    if mode == "legacy":
+        messages = []
+    else:
+        messages = CONVERSATIONS.new("bench.db", f"conv-{{s}}")
+    for t in range(turns):
+        question = f"Fråga {{s}}-{{t}}: " + FILLER
+        answer = f"Svar {{s}}-{{t}}: " + FILLER
+        ts = time.strftime("%H:%M:%S")
+        if mode == "legacy":
+            messages.append({{"role": "user", "content": question, "timestamp": ts, "id": 2 * t}})
+            history = [{{"role": m["role"], "content": m["content"]}} for m in messages]
+            full_messages = history.copy()
+            full_messages.insert(0, {{"role": "system", "content": system}})
+        else:
+            messages.add("user", question, ts, 2 * t)
+            history = messages.prompt_view()
+            full_messages = as_prompt(history, system)
+        memory.add_debug_info({{
+            "model": "gpt-4o-mini",
+            "temperature": 0.7,
+            "timestamp": time.time(),
+            "messages_count": len(history),
+            "payload": {{"messages": full_messages, "model": "gpt-4o-mini", "temperature": 0.7}},
+            "raw_response": answer,
+            "response_time": 0.1,
+            "success": True,
+        }})
+        if mode == "legacy":
+            messages.append({{"role": "assistant", "content": answer, "timestamp": ts, "id": 2 * t + 1}})
+        else:
+            messages.add("assistant", answer, ts, 2 * t + 1)
+    kept.append((messages, memory))
+gc.collect()
+print(json.dumps({{"baseline_kb": baseline, "rss_kb": rss_kb()}}))
+"""
+
+
+def measure(mode: str, sessions: int, turns: int, filler: int) -> dict:
+    snippet = SESSION_SNIPPET.format(app_dir=APP_DIR, mode=mode, sessions=sessions, turns=turns, filler=filler)
+    env = dict(os.environ)
+    env.setdefault("OPENAI_API_KEY", "sk-bench")
+    result = subprocess.run([sys.executable, "-c", snippet], env=env, capture_output=True, text=True, check=True)
+    data = json.loads(result.stdout.strip().splitlines()[-1])
+    data["per_session_kb"] = (data["rss_kb"] - data["baseline_kb"]) / sessions
+    return data
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Mät RSS per session för många samtidiga, långa konversationer.")
+    parser.add_argument("--sessions", type=int, default=1000, help="Antal samtidiga sessioner.")
+    parser.add_argument("--turns", type=int, default=40, help="Antal frågor/svar per konversation.")
+    parser.add_argument("--filler", type=int, default=8, help="Längd på varje meddelande (antal upprepningar).")
+    args = parser.parse_args()
+
+    results = {mode: measure(mode, args.sessions, args.turns, args.filler) for mode in ("legacy", "compact")}
+
+    print(f"{args.sessions} sessioner x {args.turns} turer ({2 * args.turns} meddelanden per konversation)")
+    for mode, data in results.items():
+        total_mb = (data["rss_kb"] - data["baseline_kb"]) / 1024
+        print(f"  {mode:<8} {data['per_session_kb']:8.1f} KB/session  ({total_mb:7.1f} MB totalt)")
+    legacy, compact = results["legacy"]["per_session_kb"], results["compact"]["per_session_kb"]
+    if legacy > 0:
+        print(f"  Minskning: {(1 - compact / legacy) * 100:.0f} %")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# IMPORTER
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+MODULES = ["config", "metrics", "feedback_db", "prompt", "profiler", "message_store", "memory_manager", "llm_handler", "ui_conversations", "debugpanel"]
+
+# Varje mätning körs i en ny process så att inget redan ligger i sys.modules
+IMPORT_SNIPPET = """
+import json, sys, time
+sys.path.insert(0, {app_dir!r})
+start = time.perf_counter()
+import {module}
+print(json.dumps({{"seconds": time.perf_counter() - start}}))
+"""
+
+RENDER_SNIPPET = """
+import json, sys, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+import_done = time.perf_counter()
+at = AppTest.from_file({main!r}, default_timeout=60)
+at.run()
+first = time.perf_counter()
+at.run()
+second = time.perf_counter()
+print(json.dumps({{
+    "streamlit_import": import_done - start,
+    "first_render": first - import_done,
+    "warm_rerun": second - first,
+    "langchain_loaded": "langchain_openai" in sys.modules,
+    "exceptions": [str(e.value) for e in at.exception],
+}}))
+"""
+
+
+def _run(snippet: str, cwd: str) -> dict:
+    env = dict(os.environ)
+    env.setdefault("OPENAI_API_KEY", "sk-bench")
+    result = subprocess.run([sys.executable, "-c", snippet], cwd=cwd, env=env, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+# MÄTNINGAR - IMPORT & FÖRSTA RENDERING
+def measure_imports(runs: int, cwd: str) -> dict:
+    results = {}
+    for module in MODULES + ["langchain_openai"]:
+        samples = [_run(IMPORT_SNIPPET.format(app_dir=APP_DIR, module=module), cwd)["seconds"] for _ in range(runs)]
+        results[module] = statistics.median(samples)
+    return results
+
+
+def measure_render(runs: int, cwd: str) -> dict:
+    samples = [_run(RENDER_SNIPPET.format(main=os.path.join(APP_DIR, "main.py")), cwd) for _ in range(runs)]
+    return {
+        "streamlit_import": statistics.median(s["streamlit_import"] for s in samples),
+        "first_render": statistics.median(s["first_render"] for s in samples),
+        "warm_rerun": statistics.median(s["warm_rerun"] for s in samples),
+        "langchain_loaded": any(s["langchain_loaded"] for s in samples),
+        "exceptions": samples[-1]["exceptions"],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Mät importtid och tid till första rendering för appen.")
+    parser.add_argument("--runs", type=int, default=5, help="Antal körningar per mätning (median rapporteras).")
+    args = parser.parse_args()
+
+    # Kör i en tom katalog så att benchmarken inte rör den riktiga feedback.db
+    with tempfile.TemporaryDirectory() as cwd:
+        imports = measure_imports(args.runs, cwd)
+        render = measure_render(args.runs, cwd)
+
+    print(f"Importtid (median av {args.runs}, kall process)")
+    for module, seconds in imports.items():
+        print(f"  {module:<20} {seconds * 1000:8.1f} ms")
+    print()
+    print("Rendering av main.py (AppTest)")
+    print(f"  {'streamlit-import':<20} {render['streamlit_import'] * 1000:8.1f} ms")
+    print(f"  {'första rendering':<20} {render['first_render'] * 1000:8.1f} ms")
+    print(f"  {'varm omkörning':<20} {render['warm_rerun'] * 1000:8.1f} ms")
+    print(f"  langchain_openai laddad före första LLM-anrop: {'ja' if render['langchain_loaded'] else 'nej'}")
+    if render["exceptions"]:
+        print(f"  Undantag: {render['exceptions']}")
+
+
+if __name__ == "__main__":
+    main()
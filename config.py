@@ -5,6 +5,31 @@ load_dotenv()
 
 class Config:
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+    OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
     DEFAULT_MODEL = "gpt-4o-mini"
     DEFAULT_TEMPERATURE = 0.7
     ENABLE_DANGEROUS_ACTIONS = os.getenv("ENABLE_DANGEROUS_ACTIONS", "false").lower() == "true"
+    # Krävs för vyer över alla hyresgäster (API:ts /admin/* och debugpanelen); utan token är de avstängda
+    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN") or None
+    PROFILE_MODE = os.getenv("PROFILE_MODE", "off").lower()
+    PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+    PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+    ENABLE_METRICS = os.getenv("ENABLE_METRICS", "false").lower() == "true"
+    METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+    METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+    SHARD_DIR = os.getenv("SHARD_DIR") or None
+    DEFAULT_TENANT = os.getenv("DEFAULT_TENANT", "default")
+    # Hyresgäster vars shard får skapas vid första användning; övriga måste redan finnas (split_db.py)
+    ALLOWED_TENANTS = {t.strip() for t in os.getenv("ALLOWED_TENANTS", "").split(",") if t.strip()} | {DEFAULT_TENANT}
+    ENABLE_PREFETCH = os.getenv("ENABLE_PREFETCH", "false").lower() == "true"
+    PREFETCH_TOKEN_BUDGET = int(os.getenv("PREFETCH_TOKEN_BUDGET", "4000"))
+    PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "1"))
+    PREFETCH_DISABLED_SUBJECTS = {s.strip() for s in os.getenv("PREFETCH_DISABLED_SUBJECTS", "").split(",") if s.strip()}
+    ROUTER_FAST_MODEL = os.getenv("ROUTER_FAST_MODEL", "gpt-4o-mini")
+    ROUTER_STRONG_MODEL = os.getenv("ROUTER_STRONG_MODEL", "gpt-4o")
+    ROUTER_THRESHOLD = float(os.getenv("ROUTER_THRESHOLD", "0.5"))
+    # Modeller som får väljas i appen och API:t; varje modell får en egen klient och egna metrikserier
+    AVAILABLE_MODELS = list(dict.fromkeys(
+        [m.strip() for m in os.getenv("AVAILABLE_MODELS", "gpt-4o-mini,gpt-4o").split(",") if m.strip()]
+        + [DEFAULT_MODEL, ROUTER_FAST_MODEL, ROUTER_STRONG_MODEL]
+    ))
@@ -1,16 +1,20 @@
 # IMPORTER
+import hmac
 import json
+import os
 import uuid
 from datetime import datetime
 import streamlit as st
-from feedback_db import get_recent_feedback, export_feedback_json, export_feedback_csv, delete_messages, delete_all_feedback, delete_all_data
+from feedback_db import get_feedback_summary_all, export_feedback_json_all, export_feedback_csv_all, get_routing_stats, get_recent_feedback, export_feedback_json, export_feedback_csv, delete_messages, delete_all_feedback, delete_all_data
 from config import Config
+from message_store import CONVERSATIONS
+from profiler import span
 
 # SIDOPANEL - DEBUG PANEL
 
-def render_debug_panel(memory, db_conn) -> None:
+def render_debug_panel(memory, db_conn, perf_tracker=None, shard_router=None) -> None:
     st.subheader("Debug Panel")
-    tab1, tab2, tab3 = st.tabs(["📊 Debug Info", "💬 Feedback", "⚙️ Åtgärder"])
+    tab1, tab2, tab3, tab4 = st.tabs(["📊 Debug Info", "💬 Feedback", "⚙️ Åtgärder", "⏱️ Prestanda"])
 
     with tab1:
         latest_list = memory.get_latest_debug_info(limit=1)
@@ -26,6 +30,10 @@ def render_debug_panel(memory, db_conn) -> None:
                 response_time = dbg['response_time']
                 color = "🟢" if response_time < 2.0 else "🟡" if response_time < 5.0 else "🔴"
                 st.markdown(f"• **Svarstid:** {color} `{round(response_time, 3)}s`")
+            if "ttft" in dbg:
+                st.markdown(f"• **Första token:** `{round(dbg['ttft'], 3)}s`")
+            if dbg.get("client_init_time", 0) >= 0.01:
+                st.markdown(f"• **Klientinitiering:** `{round(dbg['client_init_time'], 3)}s` (ej med i svarstiden)")
             if dbg.get("success", False):
                 st.markdown("• **Status:** ✅ Framgång")
             else:
@@ -33,10 +41,28 @@ def render_debug_panel(memory, db_conn) -> None:
                 if "error" in dbg:
                     st.markdown(f"• **Fel:** `{dbg['error']}`")
 
+            if dbg.get("prefetched"):
+                st.markdown("• **Källa:** 🔮 Förhämtat svar")
+                if "served_time" in dbg:
+                    st.markdown(f"• **Visades efter:** {dbg['served_time']:.3f}s (genereringen ovan skedde i bakgrunden)")
+            if "prompt_prefix_hash" in dbg:
+                st.markdown(f"• **Prompt-prefix:** `{dbg['prompt_prefix_hash']}`")
+
+            routing = dbg.get("routing")
+            if isinstance(routing, dict):
+                mode = "Auto" if routing.get("mode") == "auto" else "Manuell"
+                st.markdown(f"• **Routing:** {mode} · poäng `{routing.get('score')}`")
+
             token_usage = dbg.get("token_usage")
             if isinstance(token_usage, dict) and any(v != "N/A" for v in token_usage.values()):
                 st.markdown("### 🔢 Token-användning")
                 st.markdown(f"• **Prompt:** `{token_usage.get('prompt_tokens', 'N/A')}`")
+                prompt_tokens = token_usage.get("prompt_tokens")
+                cached_tokens = token_usage.get("cached_tokens", "N/A")
+                if isinstance(cached_tokens, int) and isinstance(prompt_tokens, int) and prompt_tokens > 0:
+                    st.markdown(f"• **Cachade:** `{cached_tokens}` ({cached_tokens / prompt_tokens:.0%} av prompten)")
+                else:
+                    st.markdown("• **Cachade:** `N/A`")
                 st.markdown(f"• **Completion:** `{token_usage.get('completion_tokens', 'N/A')}`")
                 st.markdown(f"• **Totalt:** `{token_usage.get('total_tokens', 'N/A')}`")
                 if token_usage.get('total_tokens') != "N/A":
@@ -48,9 +74,8 @@ def render_debug_panel(memory, db_conn) -> None:
             payload = dbg.get("payload")
             if isinstance(payload, dict):
                 st.markdown("### 📤 Payload")
-                for i, msg in enumerate(payload.get("messages", []), 1):
-                    role = msg.get("role", "unknown")
-                    content = msg.get("content", "")
+                # Meddelandena är (roll, innehåll)-par från en PromptView
+                for i, (role, content) in enumerate(payload.get("messages", []), 1):
                     if len(content) > 200:
                         content = content[:200] + "..."
                     st.markdown(f"  **{i}.** `{role}`: {content}")
@@ -66,9 +91,31 @@ def render_debug_panel(memory, db_conn) -> None:
         else:
             st.write("Ingen debug-information ännu. Skicka ett meddelande för att se data.")
 
+        with st.expander("🔀 Routingstatistik", expanded=False):
+            try:
+                with span("db:get_routing_stats"):
+                    routing_rows = get_routing_stats(db_conn)
+                if routing_rows:
+                    st.dataframe([{
+                        "Läge": r["mode"],
+                        "Modell": r["model"],
+                        "Poäng": r["score_bucket"],
+                        "Turer": r["turns"],
+                        "Förhämtade": r["prefetched"],
+                        "Svarstid (s)": round(r["avg_latency"], 2) if r["avg_latency"] is not None else None,
+                        "👍": r["thumbs_up"],
+                        "👎": r["thumbs_down"],
+                        "⭐": round(r["avg_stars"], 1) if r["avg_stars"] is not None else None,
+                    } for r in routing_rows], hide_index=True)
+                else:
+                    st.caption("Inga routingbeslut loggade än.")
+            except Exception as e:
+                st.caption(f"Kunde inte ladda routingstatistik: {e}")
+
     with tab2:
         try:
-            feedback_rows = get_recent_feedback(db_conn, limit=10)
+            with span("db:get_recent_feedback"):
+                feedback_rows = get_recent_feedback(db_conn, limit=10)
             if feedback_rows:
                 for row in feedback_rows:
                     ts = row[8] if len(row) > 8 else ""
@@ -159,7 +206,7 @@ def render_debug_panel(memory, db_conn) -> None:
                             try:
                                 delete_all_data(db_conn)
                                 st.session_state.conversation_id = str(uuid.uuid4())
-                                st.session_state.messages = []
+                                st.session_state.messages = CONVERSATIONS.new(st.session_state.db_path, st.session_state.conversation_id)
                                 st.session_state.confirm_delete_all = False
                                 memory.clear_debug_info()
                                 st.success("All data har raderats!")
@@ -176,7 +223,7 @@ def render_debug_panel(memory, db_conn) -> None:
 
         if st.button("Exportera chatt"):
             if "messages" in st.session_state and st.session_state.messages:
-                json_data = json.dumps(st.session_state.messages, ensure_ascii=False, indent=2)
+                json_data = json.dumps(st.session_state.messages.to_dicts(), ensure_ascii=False, indent=2)
                 st.download_button(
                     label="Ladda ner chatt som JSON",
                     data=json_data,
@@ -221,12 +268,46 @@ def render_debug_panel(memory, db_conn) -> None:
             except Exception as e:
                 st.warning(f"Kunde inte exportera feedback: {e}")
 
+        # Data från andra hyresgäster visas bara för den som anger admin-token
+        if shard_router is not None and shard_router.sharded and Config.ADMIN_TOKEN:
+            st.markdown("**Alla hyresgäster:**")
+            admin_token = st.text_input("Admin-token", type="password", key="admin_token")
+            is_admin = bool(admin_token) and hmac.compare_digest(admin_token.encode("utf-8"), Config.ADMIN_TOKEN.encode("utf-8"))
+            if admin_token and not is_admin:
+                st.warning("Fel admin-token.")
+        else:
+            is_admin = False
+        if is_admin:
+            if st.button("Visa feedback-sammanfattning (alla)"):
+                try:
+                    summary = get_feedback_summary_all(shard_router)
+                    st.markdown(f"👍 `{summary['up']}` · 👎 `{summary['down']}` · ⭐ `{dict(sorted(summary['stars'].items()))}`")
+                except Exception as e:
+                    st.warning(f"Kunde inte hämta sammanfattning: {e}")
+            if st.button("Exportera feedback (alla hyresgäster)"):
+                try:
+                    st.download_button(
+                        label="Ladda ner all feedback som JSON",
+                        data=export_feedback_json_all(shard_router),
+                        file_name=f"feedback_alla_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.json",
+                        mime="application/json"
+                    )
+                    st.download_button(
+                        label="Ladda ner all feedback som CSV",
+                        data=export_feedback_csv_all(shard_router),
+                        file_name=f"feedback_alla_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.csv",
+                        mime="text/csv"
+                    )
+                except Exception as e:
+                    st.warning(f"Kunde inte exportera feedback: {e}")
+
         if st.button("Exportera SQLite-databas"):
             try:
-                with open("feedback.db", "rb") as f:
+                db_path = st.session_state.get("db_path", "feedback.db")
+                with open(db_path, "rb") as f:
                     db_data = f.read()
                 st.download_button(
-                    label="Ladda ner feedback.db",
+                    label=f"Ladda ner {os.path.basename(db_path)}",
                     data=db_data,
                     file_name=f"feedback_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.db",
                     mime="application/x-sqlite3"
@@ -235,3 +316,56 @@ def render_debug_panel(memory, db_conn) -> None:
                 st.warning("Databasfilen hittades inte.")
             except Exception as e:
                 st.warning(f"Kunde inte exportera databas: {e}")
+
+    with tab4:
+        render_performance_tab(perf_tracker)
+
+
+# PRESTANDA - FASER PER KÖRNING
+def render_performance_tab(perf_tracker, limit: int = 10) -> None:
+    history = perf_tracker.get_history(limit=limit) if perf_tracker else []
+    if not history:
+        st.write("Ingen prestandadata ännu. Interagera med appen för att se körningar.")
+        return
+
+    st.caption(f"Senaste {len(history)} körningar (ms)")
+    phase_names = []
+    for run in history:
+        for name in run["phases"]:
+            if name not in phase_names:
+                phase_names.append(name)
+    rows = []
+    for run in reversed(history):
+        row = {
+            "Start": run["started_at"][11:],
+            "Totalt": round(run["total"] * 1000, 1),
+            "Klar": "✅" if run["completed"] else "⏹️",
+        }
+        for name in phase_names:
+            row[name] = round(run["phases"].get(name, 0.0) * 1000, 1)
+        row["SQL"] = len(run["queries"])
+        rows.append(row)
+    st.dataframe(rows, hide_index=True)
+
+    prefetcher = st.session_state.get("prefetcher")
+    if prefetcher is not None:
+        stats = prefetcher.get_stats()
+        hit_rate = f"{stats['hit_rate']:.0%}" if stats["hit_rate"] is not None else "–"
+        st.markdown("### 🔮 Förhämtning")
+        st.markdown(f"• **Träffar/missar:** `{stats['hits']}` / `{stats['misses']}` ({hit_rate})")
+        st.markdown(f"• **Tokens:** `{stats['tokens_used']}` av `{stats['token_budget']}` · slösade `{stats['wasted_tokens']}`")
+
+    latest = history[-1]
+    st.markdown("### 🧩 Senaste körningen")
+    for name, seconds in latest["phases"].items():
+        indent = "&nbsp;" * 4 * latest["depths"].get(name, 0)
+        st.markdown(f"{indent}• **{name.split(' / ')[-1]}:** `{seconds * 1000:.1f} ms`")
+
+    queries = sorted(latest["queries"], key=lambda q: q["duration"], reverse=True)
+    if queries:
+        with st.expander(f"SQL-satser ({len(queries)})", expanded=False):
+            st.caption("Tid räknas från satsens start till nästa sats eller fasgräns.")
+            for q in queries[:20]:
+                st.markdown(f"`{q['duration'] * 1000:.2f} ms` · {q['span']} · `{q['sql']}`")
+    if Config.PROFILE_MODE in ("cprofile", "sampling"):
+        st.caption(f"Profilering ({Config.PROFILE_MODE}) skrivs till `{Config.PROFILE_DIR}/`.")
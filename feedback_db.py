@@ -1,11 +1,31 @@
 # IMPORTER
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import csv
+import functools
 import io
 import json
+import os
+import re
+import threading
+import time
+
+from metrics import DB_QUERY_LATENCY, FEEDBACK_EVENTS
+
+# MÄTNING - TID PER DATABASFUNKTION
+def _timed(fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            DB_QUERY_LATENCY.observe(time.perf_counter() - start, function=fn.__name__)
+    return wrapper
 
 # DATABAS - INITIERING & TABELLER
+@_timed
 def init_db(db_path: str = "feedback.db") -> sqlite3.Connection:
     conn = sqlite3.connect(db_path, check_same_thread=False)
     
@@ -49,6 +69,7 @@ def init_db(db_path: str = "feedback.db") -> sqlite3.Connection:
      CREATE TABLE IF NOT EXISTS feedback (
       id INTEGER PRIMARY KEY AUTOINCREMENT,
       conversation_id TEXT,
+      message_id INTEGER,
       message_index INTEGER NOT NULL,
       role TEXT NOT NULL,
       rating_type TEXT NOT NULL CHECK (rating_type IN ('thumbs','stars')),
@@ -61,6 +82,15 @@ def init_db(db_path: str = "feedback.db") -> sqlite3.Connection:
     conn.execute("CREATE INDEX IF NOT EXISTS idx_feedback_created_at ON feedback(created_at);")
     conn.execute("CREATE INDEX IF NOT EXISTS idx_feedback_conversation ON feedback(conversation_id);")
     conn.execute("CREATE INDEX IF NOT EXISTS idx_feedback_rating_type ON feedback(rating_type);")
+
+    # Koppla feedback till meddelandets id (äldre databaser saknar kolumnen)
+    cursor = conn.execute("PRAGMA table_info(feedback);")
+    if "message_id" not in [row[1] for row in cursor.fetchall()]:
+        conn.execute("ALTER TABLE feedback ADD COLUMN message_id INTEGER;")
+    conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_feedback_message_rating
+        ON feedback(conversation_id, message_id, rating_type);
+    """)
     conn.execute("""
         CREATE TABLE IF NOT EXISTS conversations (
             id TEXT PRIMARY KEY,
@@ -91,17 +121,94 @@ def init_db(db_path: str = "feedback.db") -> sqlite3.Connection:
             updated_at TEXT NOT NULL
         );
     """)
+    # Versionsräknare för sparade prompts; triggers fångar alla skrivningar, även från andra processer
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS prompt_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        );
+    """)
+    conn.execute("INSERT OR IGNORE INTO prompt_version (id, version) VALUES (1, 0);")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_saved_prompts_{event.lower()} AFTER {event} ON saved_prompts
+            BEGIN
+                UPDATE prompt_version SET version = version + 1 WHERE id = 1;
+            END;
+        """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS routing_decisions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            conversation_id TEXT,
+            message_id INTEGER,
+            mode TEXT NOT NULL,
+            model TEXT NOT NULL,
+            score REAL,
+            features TEXT,
+            latency REAL,
+            ttft REAL,
+            success INTEGER NOT NULL,
+            prefetched INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL
+        );
+    """)
+    # Markera svar som hämtades i förväg (äldre databaser saknar kolumnen)
+    cursor = conn.execute("PRAGMA table_info(routing_decisions);")
+    if "prefetched" not in [row[1] for row in cursor.fetchall()]:
+        conn.execute("ALTER TABLE routing_decisions ADD COLUMN prefetched INTEGER NOT NULL DEFAULT 0;")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_routing_message ON routing_decisions(conversation_id, message_id);")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS eval_results (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            run_id TEXT NOT NULL,
+            question_id TEXT NOT NULL,
+            model TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            difficulty TEXT NOT NULL,
+            question TEXT NOT NULL,
+            answer TEXT,
+            success INTEGER NOT NULL,
+            error TEXT,
+            latency REAL,
+            ttft REAL,
+            prompt_tokens INTEGER,
+            completion_tokens INTEGER,
+            created_at TEXT NOT NULL,
+            UNIQUE (run_id, question_id, model, subject, difficulty)
+        );
+    """)
     conn.commit()
     return conn
 
+# ANSLUTNINGAR - DELAD HANTERING
+class ConnectionManager:
+
+    # Schema och migreringar körs en gång per process; sessioner får sedan lätta anslutningar
+    def __init__(self, db_path: str = "feedback.db"):
+        self.db_path = db_path
+        init_db(db_path).close()
+
+    def connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, check_same_thread=False)
+
 # FEEDBACK - SPARA & HÄMTA
-def save_feedback(conn, *, conversation_id, message_index, role, rating_type, rating_value, reason, message_content) -> None:
+@_timed
+def save_feedback(conn, *, conversation_id, message_id, message_index, role, rating_type, rating_value, reason, message_content) -> bool:
+    # Upsert per (konversation, meddelande, typ): omkörningar med samma betyg skriver ingenting,
+    # ett ändrat betyg uppdaterar befintlig rad. Returnerar True om något faktiskt skrevs.
     created_at = datetime.utcnow().isoformat()
-    conn.execute("""
-      INSERT INTO feedback (conversation_id, message_index, role, rating_type, rating_value, reason, message_content, created_at)
-      VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    cursor = conn.execute("""
+      INSERT INTO feedback (conversation_id, message_id, message_index, role, rating_type, rating_value, reason, message_content, created_at)
+      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+      ON CONFLICT (conversation_id, message_id, rating_type) DO UPDATE SET
+        rating_value = excluded.rating_value,
+        reason = excluded.reason,
+        created_at = excluded.created_at
+      WHERE feedback.rating_value IS NOT excluded.rating_value
+         OR feedback.reason IS NOT excluded.reason
     """, (
       conversation_id or None,
+      message_id,
       message_index,
       role,
       rating_type,
@@ -111,7 +218,12 @@ def save_feedback(conn, *, conversation_id, message_index, role, rating_type, ra
       created_at
     ))
     conn.commit()
+    saved = cursor.rowcount > 0
+    if saved:
+        FEEDBACK_EVENTS.inc(rating_type=rating_type, rating_value=rating_value)
+    return saved
 
+@_timed
 def get_feedback_summary(conn) -> dict:
     rows = conn.execute("""
       SELECT rating_type, rating_value, COUNT(*) as cnt
@@ -129,6 +241,7 @@ def get_feedback_summary(conn) -> dict:
             summary["stars"][rating_value] = summary["stars"].get(rating_value, 0) + cnt
     return summary
 
+@_timed
 def get_recent_feedback(conn, limit: int = 50) -> list[tuple]:
     rows = conn.execute(
         """
@@ -142,52 +255,57 @@ def get_recent_feedback(conn, limit: int = 50) -> list[tuple]:
     return rows
 
 # FEEDBACK - EXPORTER
-def export_feedback_csv(conn) -> bytes:
-    buf = io.StringIO()
-    writer = csv.writer(buf)
-    writer.writerow(["id","conversation_id","message_index","role","rating_type","rating_value","reason","message_content","created_at"])
-    for row in conn.execute("""
+FEEDBACK_EXPORT_COLUMNS = ["id","conversation_id","message_index","role","rating_type","rating_value","reason","message_content","created_at"]
+
+def _fetch_feedback_rows(conn) -> list:
+    return conn.execute("""
         SELECT id, conversation_id, message_index, role, rating_type, rating_value, reason, message_content, created_at
         FROM feedback
         ORDER BY id ASC
-    """):
-        writer.writerow(row)
+    """).fetchall()
+
+@_timed
+def export_feedback_csv(conn) -> bytes:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(FEEDBACK_EXPORT_COLUMNS)
+    writer.writerows(_fetch_feedback_rows(conn))
     return buf.getvalue().encode("utf-8")
 
 
+@_timed
 def export_feedback_json(conn) -> str:
-    rows = conn.execute("""
-        SELECT id, conversation_id, message_index, role, rating_type, rating_value, reason, message_content, created_at
-        FROM feedback
-        ORDER BY id ASC
-    """).fetchall()
-    cols = ["id","conversation_id","message_index","role","rating_type","rating_value","reason","message_content","created_at"]
-    as_dicts = [dict(zip(cols, r)) for r in rows]
+    as_dicts = [dict(zip(FEEDBACK_EXPORT_COLUMNS, r)) for r in _fetch_feedback_rows(conn)]
     return json.dumps(as_dicts, ensure_ascii=False, indent=2)
 
 # MEDDELANDEN - SPARA & LADDA
-def save_message(conn, *, conversation_id, role, content, timestamp) -> None:
+@_timed
+def save_message(conn, *, conversation_id, role, content, timestamp) -> int:
     created_at = datetime.utcnow().isoformat()
-    conn.execute("""
+    cursor = conn.execute("""
         INSERT INTO messages (conversation_id, role, content, timestamp, created_at)
         VALUES (?, ?, ?, ?, ?)
     """, (conversation_id, role, content, timestamp, created_at))
     conn.commit()
+    return cursor.lastrowid
 
+@_timed
 def load_messages(conn, conversation_id: str) -> list:
     rows = conn.execute("""
-        SELECT role, content, timestamp
+        SELECT id, role, content, timestamp
         FROM messages
         WHERE conversation_id = ?
         ORDER BY created_at ASC
     """, (conversation_id,)).fetchall()
-    return [{"role": r[0], "content": r[1], "timestamp": r[2]} for r in rows]
+    return [{"id": r[0], "role": r[1], "content": r[2], "timestamp": r[3]} for r in rows]
 
+@_timed
 def delete_messages(conn, conversation_id: str) -> None:
     conn.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
     conn.commit()
 
 # KONVERSATIONER - HANTERING
+@_timed
 def create_or_update_conversation(conn, conversation_id: str) -> None:
     now = datetime.utcnow().isoformat()
     conn.execute("""
@@ -196,6 +314,7 @@ def create_or_update_conversation(conn, conversation_id: str) -> None:
     """, (conversation_id, conversation_id, now, now))
     conn.commit()
 
+@_timed
 def get_all_conversations(conn) -> list:
     rows = conn.execute("""
         SELECT id, created_at, updated_at
@@ -204,13 +323,16 @@ def get_all_conversations(conn) -> list:
     """).fetchall()
     return [{"id": r[0], "created_at": r[1], "updated_at": r[2]} for r in rows]
 
+@_timed
 def delete_conversation(conn, conversation_id: str) -> None:
     conn.execute("DELETE FROM feedback WHERE conversation_id = ?", (conversation_id,))
     conn.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+    conn.execute("DELETE FROM routing_decisions WHERE conversation_id = ?", (conversation_id,))
     conn.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
     conn.commit()
 
 # SPARADE PROMPTS - HANTERING
+@_timed
 def save_prompt(conn, name: str, content: str, description: str = "") -> None:
     now = datetime.utcnow().isoformat()
     conn.execute("""
@@ -219,6 +341,7 @@ def save_prompt(conn, name: str, content: str, description: str = "") -> None:
     """, (name, content, description, name, now, now))
     conn.commit()
 
+@_timed
 def get_all_prompts(conn) -> list:
     rows = conn.execute("""
         SELECT name, content, description
@@ -227,19 +350,309 @@ def get_all_prompts(conn) -> list:
     """).fetchall()
     return [{"name": r[0], "content": r[1], "description": r[2] or ""} for r in rows]
 
+@_timed
 def delete_prompt(conn, name: str) -> None:
     conn.execute("DELETE FROM saved_prompts WHERE name = ?", (name,))
     conn.commit()
 
+@_timed
+def get_prompts_version(conn) -> int:
+    row = conn.execute("SELECT version FROM prompt_version WHERE id = 1").fetchone()
+    return row[0] if row else 0
+
+# ROUTING - BESLUT & UTFALL
+@_timed
+def save_routing_decision(conn, *, conversation_id, message_id, mode, model, score, features, latency, ttft, success, prefetched=False) -> None:
+    created_at = datetime.utcnow().isoformat()
+    conn.execute("""
+        INSERT INTO routing_decisions (conversation_id, message_id, mode, model, score, features, latency, ttft, success, prefetched, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (
+        conversation_id,
+        message_id,
+        mode,
+        model,
+        score,
+        json.dumps(features, ensure_ascii=False) if features is not None else None,
+        latency,
+        ttft,
+        1 if success else 0,
+        1 if prefetched else 0,
+        created_at
+    ))
+    conn.commit()
+
+@_timed
+def get_routing_stats(conn) -> list:
+    # Utfall per modell och poängintervall (0.1 breda), med feedback kopplad via meddelande-id.
+    # Förhämtade svar räknas som turer men inte in i svarstiderna, som då bara gäller genereringar användaren väntade på.
+    rows = conn.execute("""
+        SELECT r.mode, r.model,
+               ROUND(CAST(r.score * 10 AS INTEGER) / 10.0, 1) AS score_bucket,
+               COUNT(*) AS turns,
+               SUM(r.prefetched) AS prefetched,
+               AVG(CASE WHEN r.prefetched = 0 THEN r.latency END) AS avg_latency,
+               AVG(CASE WHEN r.prefetched = 0 THEN r.ttft END) AS avg_ttft,
+               SUM(CASE WHEN t.rating_value = 1 THEN 1 ELSE 0 END) AS thumbs_up,
+               SUM(CASE WHEN t.rating_value = -1 THEN 1 ELSE 0 END) AS thumbs_down,
+               AVG(s.rating_value) AS avg_stars
+        FROM routing_decisions r
+        LEFT JOIN feedback t ON t.conversation_id = r.conversation_id AND t.message_id = r.message_id AND t.rating_type = 'thumbs'
+        LEFT JOIN feedback s ON s.conversation_id = r.conversation_id AND s.message_id = r.message_id AND s.rating_type = 'stars'
+        WHERE r.success = 1
+        GROUP BY r.mode, r.model, score_bucket
+        ORDER BY r.mode, r.model, score_bucket
+    """).fetchall()
+    cols = ["mode", "model", "score_bucket", "turns", "prefetched", "avg_latency", "avg_ttft", "thumbs_up", "thumbs_down", "avg_stars"]
+    return [dict(zip(cols, r)) for r in rows]
+
+# UTVÄRDERING - BATCHKÖRNINGAR
+@_timed
+def save_eval_result(conn, *, run_id, question_id, model, subject, difficulty, question, answer, success, error, latency, ttft, prompt_tokens, completion_tokens) -> None:
+    created_at = datetime.utcnow().isoformat()
+    conn.execute("""
+        INSERT OR REPLACE INTO eval_results (run_id, question_id, model, subject, difficulty, question, answer, success, error, latency, ttft, prompt_tokens, completion_tokens, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (run_id, question_id, model, subject, difficulty, question, answer, 1 if success else 0, error, latency, ttft, prompt_tokens, completion_tokens, created_at))
+    conn.commit()
+
+@_timed
+def get_completed_eval_keys(conn, run_id: str) -> set:
+    # Misslyckade rader räknas inte som klara, så en återupptagen körning försöker igen
+    rows = conn.execute("""
+        SELECT question_id, model, subject, difficulty
+        FROM eval_results
+        WHERE run_id = ? AND success = 1
+    """, (run_id,)).fetchall()
+    return {tuple(r) for r in rows}
+
+@_timed
+def get_eval_results(conn, run_id: str) -> list:
+    rows = conn.execute("""
+        SELECT question_id, model, subject, difficulty, success, latency, ttft, prompt_tokens, completion_tokens, created_at
+        FROM eval_results
+        WHERE run_id = ?
+        ORDER BY id ASC
+    """, (run_id,)).fetchall()
+    cols = ["question_id", "model", "subject", "difficulty", "success", "latency", "ttft", "prompt_tokens", "completion_tokens", "created_at"]
+    return [dict(zip(cols, r)) for r in rows]
+
 # DATABAS - RENSNING
+@_timed
 def delete_all_feedback(conn) -> None:
     conn.execute("DELETE FROM feedback")
     conn.commit()
 
+@_timed
 def delete_all_data(conn) -> None:
     conn.execute("DELETE FROM feedback")
     conn.execute("DELETE FROM messages")
     conn.execute("DELETE FROM conversations")
     conn.execute("DELETE FROM saved_prompts")
+    conn.execute("DELETE FROM routing_decisions")
+    conn.execute("DELETE FROM eval_results")
     conn.commit()
 
+# SHARDING - EN DATABAS PER HYRESGÄST
+TENANT_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+class UnknownTenantError(LookupError):
+    pass
+
+class ShardRouter:
+
+    # Utan shard_dir går alla hyresgäster till default_path (samma beteende som en enda feedback.db).
+    # Nya shard-filer skapas bara för allowed_tenants eller via create_shard, aldrig av ett godtyckligt namn i en förfrågan.
+    def __init__(self, shard_dir: str = None, default_path: str = "feedback.db", max_workers: int = 8, allowed_tenants: set = None):
+        self.shard_dir = shard_dir
+        self.default_path = default_path
+        self.allowed_tenants = set(allowed_tenants or ())
+        self._managers = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="shard-fanout")
+
+    @property
+    def sharded(self) -> bool:
+        return bool(self.shard_dir)
+
+    def shard_path(self, tenant: str) -> str:
+        if not self.sharded:
+            return self.default_path
+        if not tenant or not TENANT_PATTERN.match(tenant):
+            raise ValueError(f"Ogiltig hyresgäst: {tenant!r}")
+        return os.path.join(self.shard_dir, f"{tenant}.db")
+
+    def manager(self, tenant: str, create: bool = False) -> ConnectionManager:
+        path = self.shard_path(tenant)
+        with self._lock:
+            manager = self._managers.get(path)
+            if manager is None:
+                if self.sharded:
+                    if not (create or tenant in self.allowed_tenants or os.path.exists(path)):
+                        raise UnknownTenantError(f"Okänd hyresgäst: {tenant!r}")
+                    os.makedirs(self.shard_dir, exist_ok=True)
+                manager = self._managers[path] = ConnectionManager(path)
+            return manager
+
+    def connect(self, tenant: str, create: bool = False) -> sqlite3.Connection:
+        return self.manager(tenant, create=create).connect()
+
+    # Uttryckligt adminsteg: skapa (eller öppna) en shard även om hyresgästen inte är förhandsgodkänd
+    def create_shard(self, tenant: str) -> str:
+        self.manager(tenant, create=True)
+        return self.shard_path(tenant)
+
+    def tenants(self) -> list:
+        if not self.sharded:
+            return ["default"]
+        if not os.path.isdir(self.shard_dir):
+            return []
+        return sorted(name[:-3] for name in os.listdir(self.shard_dir) if name.endswith(".db") and TENANT_PATTERN.match(name[:-3]))
+
+    # Kör fn(conn, ...) mot varje shard parallellt, med en egen anslutning per uppgift
+    def fan_out(self, fn, *args, **kwargs) -> dict:
+        def run(tenant):
+            conn = self.connect(tenant)
+            try:
+                return fn(conn, *args, **kwargs)
+            finally:
+                conn.close()
+        tenants = self.tenants()
+        return dict(zip(tenants, self._executor.map(run, tenants)))
+
+# SHARDING - ADMINVYER ÖVER ALLA HYRESGÄSTER
+def get_feedback_summary_all(router: ShardRouter) -> dict:
+    total = {"up": 0, "down": 0, "stars": {}}
+    for summary in router.fan_out(get_feedback_summary).values():
+        total["up"] += summary["up"]
+        total["down"] += summary["down"]
+        for value, cnt in summary["stars"].items():
+            total["stars"][value] = total["stars"].get(value, 0) + cnt
+    return total
+
+def export_feedback_csv_all(router: ShardRouter) -> bytes:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(["tenant"] + FEEDBACK_EXPORT_COLUMNS)
+    for tenant, rows in router.fan_out(_fetch_feedback_rows).items():
+        writer.writerows((tenant,) + tuple(r) for r in rows)
+    return buf.getvalue().encode("utf-8")
+
+def export_feedback_json_all(router: ShardRouter) -> str:
+    as_dicts = []
+    for tenant, rows in router.fan_out(_fetch_feedback_rows).items():
+        as_dicts.extend(dict(zip(["tenant"] + FEEDBACK_EXPORT_COLUMNS, (tenant,) + tuple(r))) for r in rows)
+    return json.dumps(as_dicts, ensure_ascii=False, indent=2)
+
+# SHARDING - DELA UPP EN BEFINTLIG DATABAS
+SHARDED_TABLES = {
+    "conversations": "id",
+    "messages": "conversation_id",
+    "feedback": "conversation_id",
+    "routing_decisions": "conversation_id",
+}
+
+# Kolumner som avgör om en rad med samma id redan är "samma" rad; None = alla kolumner.
+# Konversationer och feedback får ändras i sharden efter uppdelningen (updated_at, betyg) utan att räknas som konflikt.
+SPLIT_IDENTITY_COLUMNS = {
+    "conversations": ("created_at",),
+    "feedback": ("conversation_id", "message_id", "message_index", "role", "rating_type"),
+}
+
+class SplitConflictError(ValueError):
+
+    def __init__(self, conflicts: dict):
+        self.conflicts = conflicts
+        lines = []
+        for (tenant, table), ids in sorted(conflicts.items()):
+            shown = ", ".join(str(i) for i in ids[:10])
+            more = f" (+{len(ids) - 10})" if len(ids) > 10 else ""
+            lines.append(f"  {tenant}.{table}: {shown}{more}")
+        super().__init__("Id-konflikter mot befintliga rader i shardarna; inget har kopierats:\n" + "\n".join(lines))
+
+def _split_condition(table: str, column: str, tenant: str, default_tenant: str) -> str:
+    condition = f"s.{column} IN (SELECT id FROM shard_conversations)"
+    if table == "feedback" and tenant == default_tenant:
+        condition = f"({condition} OR s.conversation_id IS NULL)"
+    return condition
+
+def _split_conflicts(conn, tenant: str, default_tenant: str) -> dict:
+    conflicts = {}
+    for table, column in SHARDED_TABLES.items():
+        cols = [r[1] for r in conn.execute(f"PRAGMA main.table_info({table})") if r[1] != "id"]
+        same = " AND ".join(f"s.{c} IS m.{c}" for c in SPLIT_IDENTITY_COLUMNS.get(table) or cols)
+        rows = conn.execute(f"""
+            SELECT s.id FROM src.{table} s JOIN main.{table} m ON m.id = s.id
+            WHERE {_split_condition(table, column, tenant, default_tenant)} AND NOT ({same})
+            ORDER BY s.id
+        """).fetchall()
+        if rows:
+            conflicts[(tenant, table)] = [r[0] for r in rows]
+    rows = conn.execute("""
+        SELECT s.name FROM src.saved_prompts s JOIN main.saved_prompts m ON m.name = s.name
+        WHERE s.content IS NOT m.content
+    """).fetchall()
+    if rows:
+        conflicts[(tenant, "saved_prompts")] = [r[0] for r in rows]
+    return conflicts
+
+def split_database(src_path: str, router: ShardRouter, tenant_by_conversation: dict, default_tenant: str) -> dict:
+    # Id:n behålls så att feedback.message_id och routing_decisions.message_id fortsatt pekar rätt.
+    # Först kontrolleras alla shards: ett id som redan finns med annat innehåll avbryter hela körningen.
+    # Rader som redan finns och är identiska hoppas över, så en omkörning kopierar ingenting nytt.
+    init_db(src_path).close()
+    src = sqlite3.connect(src_path)
+    conversation_ids = {r[0] for r in src.execute("SELECT id FROM conversations")}
+    conversation_ids |= {r[0] for r in src.execute("SELECT DISTINCT conversation_id FROM messages WHERE conversation_id IS NOT NULL")}
+    conversation_ids |= {r[0] for r in src.execute("SELECT DISTINCT conversation_id FROM feedback WHERE conversation_id IS NOT NULL")}
+    src.close()
+
+    assignments = {}
+    for conversation_id in conversation_ids:
+        assignments.setdefault(tenant_by_conversation.get(conversation_id, default_tenant), []).append(conversation_id)
+    assignments.setdefault(default_tenant, [])
+
+    def attach(tenant, ids):
+        conn = router.connect(tenant, create=True)
+        conn.execute("ATTACH DATABASE ? AS src", (src_path,))
+        conn.execute("CREATE TEMP TABLE shard_conversations (id TEXT PRIMARY KEY)")
+        conn.executemany("INSERT INTO shard_conversations (id) VALUES (?)", [(i,) for i in ids])
+        return conn
+
+    conflicts = {}
+    for tenant, ids in assignments.items():
+        conn = attach(tenant, ids)
+        try:
+            conflicts.update(_split_conflicts(conn, tenant, default_tenant))
+        finally:
+            conn.close()
+    if conflicts:
+        raise SplitConflictError(conflicts)
+
+    counts = {}
+    for tenant, ids in assignments.items():
+        conn = attach(tenant, ids)
+        try:
+            counts[tenant] = {}
+            for table, column in SHARDED_TABLES.items():
+                cols = ", ".join(r[1] for r in conn.execute(f"PRAGMA main.table_info({table})"))
+                cursor = conn.execute(f"""
+                    INSERT INTO main.{table} ({cols}) SELECT {cols} FROM src.{table} s
+                    WHERE {_split_condition(table, column, tenant, default_tenant)}
+                      AND NOT EXISTS (SELECT 1 FROM main.{table} m WHERE m.id = s.id)
+                """)
+                counts[tenant][table] = cursor.rowcount
+            # Sparade prompts är gemensamma och kopieras till varje shard (nya id:n; namnet är nyckeln)
+            cursor = conn.execute("""
+                INSERT INTO main.saved_prompts (name, content, description, created_at, updated_at)
+                SELECT name, content, description, created_at, updated_at FROM src.saved_prompts s
+                WHERE NOT EXISTS (SELECT 1 FROM main.saved_prompts m WHERE m.name = s.name)
+            """)
+            counts[tenant]["saved_prompts"] = cursor.rowcount
+            conn.commit()
+        except sqlite3.IntegrityError as e:
+            conn.rollback()
+            raise ValueError(f"Kunde inte kopiera till {tenant}: {e}")
+        finally:
+            conn.close()
+    return counts
@@ -1,60 +1,102 @@
 # IMPORTER
-import time 
-from typing import Dict, Any  
-from langchain_openai import ChatOpenAI  
+import hashlib
+import threading
+import time
+from typing import Dict, Any
 from config import Config
+from message_store import as_prompt
+from metrics import LLM_REQUESTS, LLM_LATENCY, LLM_TTFT, LLM_TOKENS
 
 # LLMHANDLER - OPENAI-INTEGRATION
 class LLMHandler:
-    
-    def __init__(self, model_name: str = None, temperature: float = None):
+
+    def __init__(self, model_name: str = None, temperature: float = None, *, base_url: str = None, api_key: str = None):
         self.model_name = model_name or Config.DEFAULT_MODEL
-        self.temperature = temperature or Config.DEFAULT_TEMPERATURE
-        self.model = None
-        self._initialize_model()
-    
-    def _initialize_model(self) -> None:
+        self.temperature = temperature if temperature is not None else Config.DEFAULT_TEMPERATURE
+        self.base_url = base_url or Config.OPENAI_BASE_URL
+        self.api_key = api_key or Config.OPENAI_API_KEY
+        self._models: Dict[tuple, Any] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        return self._get_model(self.model_name, self.temperature)
+
+    # En klient per (modell, temperatur), skapad vid första användningen och sedan återanvänd
+    def _get_model(self, model_name: str, temperature: float):
+        key = (model_name, temperature)
+        model = self._models.get(key)
+        if model is None:
+            with self._lock:
+                model = self._models.get(key)
+                if model is None:
+                    model = self._models[key] = self._initialize_model(model_name, temperature)
+        return model
+
+    # Bygger och cachar klienten i förväg, t.ex. innan en mätning startar
+    def warm_up(self, model_name: str = None, temperature: float = None) -> None:
+        self._get_model(model_name or self.model_name, self.temperature if temperature is None else temperature)
+
+    def _initialize_model(self, model_name: str, temperature: float):
+        # langchain_openai drar in ett stort beroendeträd; importeras först vid första anropet
+        from langchain_openai import ChatOpenAI
         try:
-            self.model = ChatOpenAI(
-                model=self.model_name,
-                temperature=self.temperature,
-                api_key=Config.OPENAI_API_KEY,
-                streaming=True
+            return ChatOpenAI(
+                model=model_name,
+                temperature=temperature,
+                api_key=self.api_key,
+                base_url=self.base_url,
+                streaming=True,
+                stream_usage=True
             )
         except Exception as e:
             raise Exception(f"Kunde inte initiera modell: {str(e)}")
-    
+
     def update_model_settings(self, model_name: str = None, temperature: float = None) -> None:
         if model_name:
             self.model_name = model_name
         if temperature is not None:
             self.temperature = temperature
-        
-        self._initialize_model()
 
-    def stream(self, messages: list, system_message: str = None):
+    def stream(self, messages: list, system_message: str = None, *, model_name: str = None, temperature: float = None, source: str = "user"):
+        model_name = model_name or self.model_name
+        temperature = temperature if temperature is not None else self.temperature
         start_time = time.time()
         debug_info = {
-            "model": self.model_name,
-            "temperature": self.temperature,
+            "model": model_name,
+            "temperature": temperature,
             "timestamp": time.time(),
-            "messages_count": len(messages)
+            "messages_count": len(messages),
+            "source": source
         }
-        full_messages = messages.copy()
+        # En vy över historiken; varken listan eller meddelandena kopieras
+        full_messages = as_prompt(messages, system_message)
         if system_message:
-            full_messages.insert(0, {"role": "system", "content": system_message})
+            # Samma hash mellan anrop betyder att prefixet kan återanvändas av leverantörens cache
+            debug_info["prompt_prefix_hash"] = hashlib.sha1(system_message.encode("utf-8")).hexdigest()[:12]
         debug_info["payload"] = {
             "messages": full_messages,
-            "model": self.model_name,
-            "temperature": self.temperature
+            "model": model_name,
+            "temperature": temperature
         }
         chunks = []
+        usage = None
         try:
-            for event in self.model.stream(full_messages):
+            model = self._get_model(model_name, temperature)
+            # Klientbygget (med den fördröjda importen) är en egen fas och räknas inte in i svarstid/TTFT
+            client_ready = time.time()
+            debug_info["client_init_time"] = client_ready - start_time
+            start_time = client_ready
+            for event in model.stream(full_messages):
+                if getattr(event, "usage_metadata", None):
+                    usage = event.usage_metadata
                 text = getattr(event, "content", "")
                 if isinstance(text, list):
                     text = "".join([t.get("text", "") if isinstance(t, dict) else str(t) for t in text])
                 if text:
+                    if not chunks:
+                        debug_info["ttft"] = time.time() - start_time
+                        LLM_TTFT.observe(debug_info["ttft"], model=model_name, source=source)
                     chunks.append(text)
                     yield {"type": "token", "text": text}
             full_text = "".join(chunks)
@@ -62,6 +104,21 @@ class LLMHandler:
             debug_info["response_time"] = end_time - start_time
             debug_info["success"] = True
             debug_info["raw_response"] = full_text
+            if usage:
+                # input_token_details fylls bara i av nyare langchain-versioner; saknas fältet visas N/A, inte 0
+                cached_tokens = (usage.get("input_token_details") or {}).get("cache_read")
+                debug_info["token_usage"] = {
+                    "prompt_tokens": usage.get("input_tokens", "N/A"),
+                    "cached_tokens": "N/A" if cached_tokens is None else cached_tokens,
+                    "completion_tokens": usage.get("output_tokens", "N/A"),
+                    "total_tokens": usage.get("total_tokens", "N/A"),
+                }
+                LLM_TOKENS.inc(usage.get("input_tokens", 0), model=model_name, kind="prompt", source=source)
+                if cached_tokens is not None:
+                    LLM_TOKENS.inc(cached_tokens, model=model_name, kind="cached", source=source)
+                LLM_TOKENS.inc(usage.get("output_tokens", 0), model=model_name, kind="completion", source=source)
+            LLM_REQUESTS.inc(model=model_name, status="success", source=source)
+            LLM_LATENCY.observe(debug_info["response_time"], model=model_name, source=source)
             yield {"type": "done", "text": full_text, "debug": debug_info}
         except Exception as e:
             end_time = time.time()
@@ -69,9 +126,11 @@ class LLMHandler:
             debug_info["success"] = False
             debug_info["error"] = str(e)
             debug_info["error_type"] = type(e).__name__
+            LLM_REQUESTS.inc(model=model_name, status="error", source=source)
+            LLM_LATENCY.observe(debug_info["response_time"], model=model_name, source=source)
             yield {"type": "error", "error": str(e), "debug": debug_info}
-    
+
     # STREAMING-WRAPPER MED MODELLINSTÄLLNINGAR
+    # Inställningarna gäller bara detta anrop, så en handler kan delas mellan sessioner
     def stream_with_settings(self, *, model_name: str, temperature: float, messages: list, system_message: str = None):
-        self.update_model_settings(model_name=model_name, temperature=temperature)
-        return self.stream(messages, system_message=system_message)
+        return self.stream(messages, system_message=system_message, model_name=model_name, temperature=temperature)
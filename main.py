@@ -1,76 +1,151 @@
 # IMPORTER
-import os
 import streamlit as st
 from datetime import datetime
-from dotenv import load_dotenv
 
 from memory_manager import MemoryManager
 from llm_handler import LLMHandler
 from ui_conversations import render_conversations_sidebar
 from debugpanel import render_debug_panel
-from feedback_db import init_db, save_feedback, get_feedback_summary, save_message, load_messages, create_or_update_conversation, get_all_prompts
-from prompt import get_system_prompt as get_system_prompt_from_prompt
+from feedback_db import ShardRouter, UnknownTenantError, save_routing_decision, save_feedback, get_feedback_summary, save_message, create_or_update_conversation
+from prompt import get_system_prompt as get_system_prompt_from_prompt, get_feedback_hint
+from prompt_registry import PromptRegistry
+from profiler import PerfTracker, span, install_query_tracer
+from metrics import start_metrics_server, touch_session
+from config import Config
+from prefetch import FollowUpPrefetcher, propose_follow_ups, prefetch_enabled
+from model_router import AUTO_MODEL, resolve_route, record_decision
+from message_store import CONVERSATIONS, Conversation
+import time
 import uuid
 
 # HJÄLPFUNKTIONER - MEDDELANDEN & KONVERSATION
 def add_message_to_chat(role, content, timestamp=None):
     if "messages" not in st.session_state:
-        st.session_state.messages = []
+        st.session_state.messages = Conversation(st.session_state.get("conversation_id"))
     if not timestamp:
         timestamp = datetime.now().strftime("%H:%M:%S")
-    message = {
-        "role": role,
-        "content": content,
-        "timestamp": timestamp
-    }
-    st.session_state.messages.append(message)
+    message = st.session_state.messages.add(role, content, timestamp)
     if "db_conn" in st.session_state and "conversation_id" in st.session_state:
         try:
-            create_or_update_conversation(st.session_state.db_conn, st.session_state.conversation_id)
-            save_message(
-                st.session_state.db_conn,
-                conversation_id=st.session_state.conversation_id,
-                role=role,
-                content=content,
-                timestamp=timestamp
-            )
+            with span("db:save_message"):
+                create_or_update_conversation(st.session_state.db_conn, st.session_state.conversation_id)
+                message.id = save_message(
+                    st.session_state.db_conn,
+                    conversation_id=st.session_state.conversation_id,
+                    role=role,
+                    content=content,
+                    timestamp=timestamp
+                )
         except Exception as e:
             st.warning(f"Kunde inte spara meddelande i databas: {e}")
+    return message
 
+# Vy med (roll, innehåll)-par över sessionens konversation; ingen ny lista per tur
 def get_conversation_history():
-    if "messages" not in st.session_state or not st.session_state.messages:
+    if "messages" not in st.session_state:
         return []
-    return [{"role": msg["role"], "content": msg["content"]} for msg in st.session_state.messages]
+    return st.session_state.messages.prompt_view()
+
+def load_conversation(conversation_id: str) -> Conversation:
+    try:
+        with span("db:load_messages"):
+            return CONVERSATIONS.load(st.session_state.db_conn, st.session_state.db_path, conversation_id)
+    except Exception:
+        return CONVERSATIONS.new(st.session_state.db_path, conversation_id)
+
+# RESURSER - DELAS MELLAN SESSIONER OCH OMKÖRNINGAR
+@st.cache_resource
+def get_shard_router() -> ShardRouter:
+    return ShardRouter(shard_dir=Config.SHARD_DIR, default_path="feedback.db", allowed_tenants=Config.ALLOWED_TENANTS)
+
+@st.cache_resource
+def get_llm_handler() -> LLMHandler:
+    return LLMHandler()
+
+# Startas en gång per process; ett misslyckat försök cachas också så att felet bara loggas en gång
+@st.cache_resource
+def get_metrics_server():
+    try:
+        server = start_metrics_server(Config.METRICS_PORT, Config.METRICS_HOST)
+    except OSError as e:
+        print(f"Kunde inte starta metrics-server på port {Config.METRICS_PORT}: {e}")
+        return None
+    print(f"Metrics på http://{Config.METRICS_HOST}:{Config.METRICS_PORT}/metrics")
+    return server
+
+# Ett register per databasfil (shard), delat av alla sessioner mot den filen
+@st.cache_resource
+def get_prompt_registry(db_path: str) -> PromptRegistry:
+    return PromptRegistry()
+
+def get_saved_prompts() -> dict:
+    if "db_conn" not in st.session_state:
+        return {}
+    try:
+        with span("db:saved_prompts"):
+            return get_prompt_registry(st.session_state.db_path).prompts(st.session_state.db_conn)
+    except Exception:
+        return {}
 
 # HJÄLPFUNKTIONER - STATE INITIERING
 def init_session_state():
     if "db_conn" not in st.session_state:
-        st.session_state.db_conn = init_db("feedback.db")
+        # Hyresgäst (t.ex. klass) väljs via ?tenant=...; varje hyresgäst har sin egen SQLite-fil
+        tenant = st.query_params.get("tenant") or Config.DEFAULT_TENANT
+        router = get_shard_router()
+        try:
+            db_conn = router.connect(tenant)
+        except (ValueError, UnknownTenantError) as e:
+            st.error(str(e))
+            st.stop()
+        st.session_state.db_path = router.shard_path(tenant)
+        st.session_state.tenant = tenant
+        st.session_state.db_conn = db_conn
+        install_query_tracer(st.session_state.db_conn)
     
     if "conversation_id" not in st.session_state:
         st.session_state.conversation_id = str(uuid.uuid4())
-        try:
-            messages = load_messages(st.session_state.db_conn, st.session_state.conversation_id)
-            st.session_state.messages = messages if messages else []
-        except Exception:
-            st.session_state.messages = []
-    else:
-        if "messages" not in st.session_state:
-            try:
-                messages = load_messages(st.session_state.db_conn, st.session_state.conversation_id)
-                st.session_state.messages = messages if messages else []
-            except Exception:
-                st.session_state.messages = []
+        st.session_state.messages = load_conversation(st.session_state.conversation_id)
+    elif "messages" not in st.session_state:
+        st.session_state.messages = load_conversation(st.session_state.conversation_id)
+
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = str(uuid.uuid4())
+    touch_session(st.session_state.session_id)
 
     st.session_state.setdefault("subject", "Programmering")
     st.session_state.setdefault("difficulty", "Medel")
-    
-    if "saved_prompts" not in st.session_state:
-        try:
-            prompts = get_all_prompts(st.session_state.db_conn)
-            st.session_state.saved_prompts = {p["name"]: {"content": p["content"], "description": p["description"]} for p in prompts}
-        except Exception:
-            st.session_state.saved_prompts = {}
+
+
+# HJÄLPFUNKTIONER - MODELLROUTING
+def resolve_model(selected_model: str, conversation_history: list, record: bool = True) -> dict:
+    last_user_text = next((content for role, content in reversed(conversation_history) if role == "user"), "")
+    subject = st.session_state.get("subject", "Programmering")
+    difficulty = st.session_state.get("difficulty", "Medel")
+    history_length = max(len(conversation_history) - 1, 0)
+    return resolve_route(selected_model, last_user_text, subject, difficulty, history_length, record=record)
+
+def log_routing(routing: dict, message_id, debug_info: dict, prefetched: bool = False) -> None:
+    if "db_conn" not in st.session_state:
+        return
+    try:
+        with span("db:save_routing_decision"):
+            save_routing_decision(
+                st.session_state.db_conn,
+                conversation_id=st.session_state.get("conversation_id"),
+                message_id=message_id,
+                mode=routing["mode"],
+                model=routing["model"],
+                score=routing.get("score"),
+                features=routing.get("features"),
+                # Förhämtade svar loggas med tiden användaren faktiskt väntade, inte bakgrundsgenereringens
+                latency=debug_info.get("served_time") if prefetched else debug_info.get("response_time"),
+                ttft=debug_info.get("served_time") if prefetched else debug_info.get("ttft"),
+                success=debug_info.get("success", False),
+                prefetched=prefetched
+            )
+    except Exception:
+        pass
 
 # HJÄLPFUNKTIONER - LLM ANROP
 def handle_llm_request(model_name: str, temperature: float, system_message: str = None):
@@ -78,35 +153,45 @@ def handle_llm_request(model_name: str, temperature: float, system_message: str
     try:
         conversation_history = get_conversation_history()
         system_prompt_text = system_message or get_system_prompt()
+        selected_model = model_name
+        routing = resolve_model(selected_model, conversation_history)
+        model_name = routing["model"]
+        debug_info = {}
 
         with st.chat_message("assistant"):
             placeholder = st.empty()
             accumulated = ""
-            for event in llm_handler.stream_with_settings(
-                model_name=model_name,
-                temperature=temperature,
-                messages=conversation_history,
-                system_message=system_prompt_text,
-            ):
-                if st.session_state.get("abort_requested", False):
-                    st.warning("Anrop avbrutet av användaren.")
-                    break
-                if event.get("type") == "token":
-                    accumulated += event.get("text", "")
-                    placeholder.write(accumulated)
-                elif event.get("type") == "done":
-                    accumulated = event.get("text", accumulated)
-                    placeholder.write(accumulated)
-                    debug_info = event.get("debug", {})
-                    memory.add_debug_info(debug_info)
-                elif event.get("type") == "error":
-                    debug_info = event.get("debug", {})
-                    memory.add_debug_info(debug_info)
-                    st.error(f"Fel vid AI-anrop: {event.get('error')}")
-                    return False
+            with span("llm_stream"):
+                for event in llm_handler.stream_with_settings(
+                    model_name=model_name,
+                    temperature=temperature,
+                    messages=conversation_history,
+                    system_message=system_prompt_text,
+                ):
+                    if st.session_state.get("abort_requested", False):
+                        st.warning("Anrop avbrutet av användaren.")
+                        break
+                    if event.get("type") == "token":
+                        accumulated += event.get("text", "")
+                        placeholder.write(accumulated)
+                    elif event.get("type") == "done":
+                        accumulated = event.get("text", accumulated)
+                        placeholder.write(accumulated)
+                        debug_info = event.get("debug", {})
+                        debug_info["routing"] = routing
+                        memory.add_debug_info(debug_info)
+                    elif event.get("type") == "error":
+                        debug_info = event.get("debug", {})
+                        debug_info["routing"] = routing
+                        memory.add_debug_info(debug_info)
+                        log_routing(routing, None, debug_info)
+                        st.error(f"Fel vid AI-anrop: {event.get('error')}")
+                        return False
 
         if accumulated:
-            add_message_to_chat("assistant", accumulated)
+            message = add_message_to_chat("assistant", accumulated)
+            log_routing(routing, message.get("id"), debug_info)
+            schedule_follow_ups(system_prompt_text, selected_model, temperature)
             return True
         return False
     except Exception as e:
@@ -114,51 +199,130 @@ def handle_llm_request(model_name: str, temperature: float, system_message: str
             st.error(f"Fel vid AI-anrop: {str(e)}")
         return False
 
+# HJÄLPFUNKTIONER - FÖLJDFRÅGOR & FÖRHÄMTNING
+def schedule_follow_ups(system_prompt_text: str, selected_model: str, temperature: float) -> None:
+    subject = st.session_state.get("subject", "Programmering")
+    difficulty = st.session_state.get("difficulty", "Medel")
+    st.session_state.follow_ups = propose_follow_ups(subject, difficulty)
+    st.session_state.follow_ups_conversation = st.session_state.get("conversation_id")
+    if not prefetch_enabled(subject):
+        return
+    if "prefetcher" not in st.session_state:
+        st.session_state.prefetcher = FollowUpPrefetcher()
+    history = get_conversation_history()
+    # Varje följdfråga förhämtas med den modell ett riktigt klick skulle routas till
+    models = {
+        question: resolve_model(selected_model, history + [("user", question)], record=False)["model"]
+        for question in st.session_state.follow_ups
+    }
+    st.session_state.prefetcher.schedule(
+        llm_handler,
+        questions=st.session_state.follow_ups,
+        history=history,
+        system_message=system_prompt_text,
+        models=models,
+        temperature=temperature,
+        subject=subject
+    )
+
+def select_follow_up(question: str) -> None:
+    st.session_state.pending_follow_up = question
+
+def handle_follow_up(question: str, model_name: str, temperature: float) -> bool:
+    prefetcher = st.session_state.get("prefetcher")
+    if prefetcher is not None and prefetch_enabled(st.session_state.get("subject", "Programmering")):
+        system_prompt_text = get_system_prompt()
+        routing = resolve_model(model_name, get_conversation_history(), record=False)
+        requested_at = time.time()
+        with span("prefetch_take"):
+            # Följdfrågan ligger redan sist i historiken; förhämtningen gjordes utan den
+            result = prefetcher.take(
+                question,
+                len(st.session_state.messages) - 1,
+                system_message=system_prompt_text,
+                model_name=routing["model"],
+                temperature=temperature
+            )
+        if result is not None:
+            with st.chat_message("assistant"):
+                st.write(result["text"])
+            debug_info = result.get("debug", {})
+            debug_info["prefetched"] = True
+            debug_info["served_time"] = time.time() - requested_at
+            debug_info["routing"] = routing
+            memory.add_debug_info(debug_info)
+            message = add_message_to_chat("assistant", result["text"])
+            # Förhämtningen routades hypotetiskt; nu när svaret används räknas och loggas beslutet
+            if routing["mode"] == "auto":
+                record_decision(routing)
+            log_routing(routing, message.get("id"), debug_info, prefetched=True)
+            schedule_follow_ups(system_prompt_text, model_name, temperature)
+            return True
+    return handle_llm_request(model_name, temperature)
+
 # HJÄLPFUNKTIONER - PROMPTS & EXEMPEL
 def get_system_prompt():
     selected_saved_prompt = st.session_state.get("selected_saved_prompt", "Ingen prompt vald")
-    saved_prompts = st.session_state.get("saved_prompts", {})
+    saved_prompts = get_saved_prompts()
     subject = st.session_state.get("subject", "Programmering")
     difficulty = st.session_state.get("difficulty", "Medel")
     
-    feedback_summary = None
-    try:
-        if "db_conn" in st.session_state:
-            feedback_summary = get_feedback_summary(st.session_state.db_conn)
-    except Exception:
-        pass
-    
     return get_system_prompt_from_prompt(
         selected_saved_prompt=selected_saved_prompt,
         saved_prompts=saved_prompts,
         subject=subject,
         difficulty=difficulty,
-        feedback_summary=feedback_summary
+        feedback_hint=get_conversation_feedback_hint()
     )
 
+# Tipset frysas per konversation så att systemprompten, och därmed cache-prefixet, är byte-stabilt
+def get_conversation_feedback_hint() -> str:
+    conversation_id = st.session_state.get("conversation_id")
+    hints = st.session_state.setdefault("feedback_hints", {})
+    if conversation_id in hints:
+        return hints[conversation_id]
+    feedback_summary = None
+    try:
+        if "db_conn" in st.session_state:
+            with span("db:get_feedback_summary"):
+                feedback_summary = get_feedback_summary(st.session_state.db_conn)
+    except Exception:
+        pass
+    hints[conversation_id] = get_feedback_hint(feedback_summary)
+    return hints[conversation_id]
+
 # INITIERING - API-KEY & KONFIGURATION
-load_dotenv()
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
+if not Config.OPENAI_API_KEY:
     st.error("API-nyckel saknas. Lägg till OPENAI_API_KEY i .env och starta om.")
     st.stop()
 
 st.set_page_config(page_title="AI-chat", layout="wide")
 
-memory = MemoryManager()
-llm_handler = LLMHandler()
+if Config.ENABLE_METRICS:
+    get_metrics_server()
+
+if "perf_tracker" not in st.session_state:
+    st.session_state.perf_tracker = PerfTracker()
+perf_tracker = st.session_state.perf_tracker
+perf_tracker.start_rerun()
+
+if "memory" not in st.session_state:
+    st.session_state.memory = MemoryManager()
+memory = st.session_state.memory
+llm_handler = get_llm_handler()
 
 # INITIERING - DATABAS & STATE
-init_session_state()
+with span("init_session_state"):
+    init_session_state()
 
 # SIDOPANEL - INSTÄLLNINGAR & KONFIGURATION
-with st.sidebar:    
+with span("sidebar"), st.sidebar:
     st.header("Modellinställningar")
     model = st.selectbox(
         "Modell",
-        options=["gpt-4o-mini", "gpt-4o"],
+        options=[AUTO_MODEL] + Config.AVAILABLE_MODELS,
         index=0,
-        help="Välj modell för nästa anrop."
+        help="Välj modell för nästa anrop. Auto väljer den snabbare modellen för enkla frågor."
     )
     temp = st.slider(
         "Temperatur",
@@ -180,72 +344,111 @@ with st.sidebar:
         key="difficulty",
         help="Välj nivå: Lätt för introduktion, Medel för fördjupning, Svår för avancerat."
     )
+    saved_prompt_names = list(get_saved_prompts())
+    if saved_prompt_names:
+        if st.session_state.get("selected_saved_prompt") not in ["Ingen prompt vald"] + saved_prompt_names:
+            st.session_state.selected_saved_prompt = "Ingen prompt vald"
+        st.selectbox(
+            "Sparad prompt",
+            ["Ingen prompt vald"] + saved_prompt_names,
+            key="selected_saved_prompt",
+            help="Använd en sparad systemprompt. {subject} och {difficulty} fylls i automatiskt."
+        )
 
     st.markdown("---")
     if "db_conn" in st.session_state:
-        render_conversations_sidebar(st.session_state.db_conn)
+        with span("conversations"):
+            render_conversations_sidebar(st.session_state.db_conn)
     st.markdown("---")
     if "db_conn" in st.session_state:
-        render_debug_panel(memory, st.session_state.db_conn)
+        with span("debug_panel"):
+            render_debug_panel(memory, st.session_state.db_conn, perf_tracker, get_shard_router())
 
 # HUVUDINNEHÅLL - CHATT
 st.title("Levent's AI Lärare")
 
 user_text = st.chat_input("Skriv ditt meddelande...")
+follow_up = st.session_state.pop("pending_follow_up", None)
 if user_text:
+    # En egen fråga gör väntande förhämtningar inaktuella
+    if "prefetcher" in st.session_state:
+        st.session_state.prefetcher.discard()
     add_message_to_chat("user", user_text)
+elif follow_up:
+    add_message_to_chat("user", follow_up)
+if user_text or follow_up:
+    st.session_state.follow_ups = []
 
 # Container som håller chattmeddelandena
-with st.container():
+with span("render_messages"), st.container():
     if "messages" not in st.session_state:
-        st.session_state.messages = []
+        st.session_state.messages = Conversation(st.session_state.conversation_id)
     for idx, message in enumerate(st.session_state.messages):
         with st.chat_message(message["role"]):
             st.write(message["content"])
             if "timestamp" in message:
                 st.caption(f"{message['timestamp']}")
             if message["role"] == "assistant":
+                message_key = message.get("id", f"idx{idx}")
                 col1, col2 = st.columns([1, 5])
                 with col1:
-                    thumbs = st.feedback("thumbs", key=f"fb_thumbs_{idx}")
+                    thumbs = st.feedback("thumbs", key=f"fb_thumbs_{message_key}")
                 with col2:
-                    stars = st.feedback("stars", key=f"fb_stars_{idx}")
+                    stars = st.feedback("stars", key=f"fb_stars_{message_key}")
 
-                if thumbs is not None and not st.session_state.get(f"fb_thumbs_saved_{idx}", False):
-                    if "db_conn" in st.session_state and "conversation_id" in st.session_state:
+                # Feedback kräver ett sparat meddelande-id; upserten gör omkörningar billiga
+                if message.get("id") is not None and "db_conn" in st.session_state and "conversation_id" in st.session_state:
+                    if thumbs is not None:
                         try:
-                            save_feedback(
-                                st.session_state.db_conn,
-                                conversation_id=st.session_state.conversation_id,
-                                message_index=idx,
-                                role=message.get("role", "assistant"),
-                                rating_type="thumbs",
-                                rating_value=1 if thumbs == 1 else -1,
-                                reason="",
-                                message_content=message.get("content", "")
-                            )
-                            st.session_state[f"fb_thumbs_saved_{idx}"] = True
-                            st.toast("✅ Tack för din feedback!")
+                            with span("db:save_feedback"):
+                                saved = save_feedback(
+                                    st.session_state.db_conn,
+                                    conversation_id=st.session_state.conversation_id,
+                                    message_id=message["id"],
+                                    message_index=idx,
+                                    role=message.get("role", "assistant"),
+                                    rating_type="thumbs",
+                                    rating_value=1 if thumbs == 1 else -1,
+                                    reason="",
+                                    message_content=message.get("content", "")
+                                )
+                            if saved:
+                                st.toast("✅ Tack för din feedback!")
                         except Exception as e:
                             st.warning(f"Kunde inte spara feedback: {e}")
 
-                if stars is not None and not st.session_state.get(f"fb_stars_saved_{idx}", False):
-                    if "db_conn" in st.session_state and "conversation_id" in st.session_state:
+                    if stars is not None:
                         try:
-                            save_feedback(
-                                st.session_state.db_conn,
-                                conversation_id=st.session_state.conversation_id,
-                                message_index=idx,
-                                role=message.get("role", "assistant"),
-                                rating_type="stars",
-                                rating_value=stars + 1,
-                                reason="",
-                                message_content=message.get("content", "")
-                            )
-                            st.session_state[f"fb_stars_saved_{idx}"] = True
-                            st.toast(f"✅ {stars+1} stjärnor!")
+                            with span("db:save_feedback"):
+                                saved = save_feedback(
+                                    st.session_state.db_conn,
+                                    conversation_id=st.session_state.conversation_id,
+                                    message_id=message["id"],
+                                    message_index=idx,
+                                    role=message.get("role", "assistant"),
+                                    rating_type="stars",
+                                    rating_value=stars + 1,
+                                    reason="",
+                                    message_content=message.get("content", "")
+                                )
+                            if saved:
+                                st.toast(f"✅ {stars+1} stjärnor!")
                         except Exception as e:
                             st.warning(f"Kunde inte spara feedback: {e}")
 
     if user_text:
-        handle_llm_request(model, temp)
\ No newline at end of file
+        with span("llm_request"):
+            handle_llm_request(model, temp)
+    elif follow_up:
+        with span("follow_up"):
+            handle_follow_up(follow_up, model, temp)
+
+    follow_ups = st.session_state.get("follow_ups", [])
+    messages = st.session_state.messages
+    if (follow_ups and messages and messages[-1]["role"] == "assistant"
+            and st.session_state.get("follow_ups_conversation") == st.session_state.get("conversation_id")):
+        cols = st.columns(len(follow_ups))
+        for col, question in zip(cols, follow_ups):
+            col.button(question, key=f"follow_up_{question}", on_click=select_follow_up, args=(question,))
+
+perf_tracker.finish_rerun()
@@ -0,0 +1,185 @@
+# IMPORTER
+import sys
+import threading
+import weakref
+from collections.abc import Sequence
+from typing import Iterable, Optional
+
+from feedback_db import load_messages
+
+# Rollerna återkommer i varje meddelande; en delad strängkopia per roll i hela processen
+ROLES = {role: sys.intern(role) for role in ("system", "user", "assistant")}
+
+
+def intern_role(role: str) -> str:
+    return ROLES.get(role) or sys.intern(role)
+
+
+# MEDDELANDE - KOMPAKT POST MED DICT-LIKNANDE LÄSNING
+class Message:
+    __slots__ = ("id", "role", "content", "timestamp")
+
+    def __init__(self, role: str, content: str, timestamp: Optional[str] = None, id: Optional[int] = None):
+        self.id = id
+        self.role = intern_role(role)
+        self.content = content
+        self.timestamp = timestamp
+
+    # Äldre kod läser message["role"] och message.get("id"); saknade värden beter sig som saknade nycklar
+    def __getitem__(self, key: str):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        value = getattr(self, key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def get(self, key: str, default=None):
+        value = getattr(self, key, None) if key in self.__slots__ else None
+        return default if value is None else value
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.__slots__ and getattr(self, key) is not None
+
+    def to_dict(self) -> dict:
+        return {key: getattr(self, key) for key in self.__slots__ if getattr(self, key) is not None}
+
+    def __repr__(self) -> str:
+        return f"Message(id={self.id!r}, role={self.role!r}, content={self.content[:30]!r})"
+
+
+def _as_pair(message) -> tuple:
+    if isinstance(message, Message):
+        return (message.role, message.content)
+    if isinstance(message, tuple):
+        return message
+    return (message["role"], message["content"])
+
+
+# PROMPTVY - (roll, innehåll)-par utan att kopiera historiken
+# LangChain tar emot tupler direkt, så vyn kan skickas till modellen som den är.
+class PromptView(Sequence):
+    __slots__ = ("_items", "_length", "_system", "_extra")
+
+    def __init__(self, items: list, length: Optional[int] = None, system: Optional[str] = None, extra: tuple = ()):
+        self._items = items
+        # Längden fryses när vyn skapas; senare tillägg i samma lista syns inte
+        self._length = len(items) if length is None else length
+        self._system = system
+        self._extra = extra
+
+    def __len__(self) -> int:
+        return (1 if self._system else 0) + self._length + len(self._extra)
+
+    def __iter__(self):
+        if self._system:
+            yield ("system", self._system)
+        items = self._items
+        for i in range(self._length):
+            yield _as_pair(items[i])
+        yield from self._extra
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("PromptView index out of range")
+        if self._system:
+            if index == 0:
+                return ("system", self._system)
+            index -= 1
+        if index < self._length:
+            return _as_pair(self._items[index])
+        return self._extra[index - self._length]
+
+    def with_system(self, system: Optional[str]) -> "PromptView":
+        return PromptView(self._items, self._length, system, self._extra)
+
+    # history + [{"role": "user", "content": ...}] ger en ny vy; historiken delas fortfarande
+    def __add__(self, other: Iterable) -> "PromptView":
+        return PromptView(self._items, self._length, self._system, self._extra + tuple(_as_pair(m) for m in other))
+
+    def to_dicts(self) -> list:
+        return [{"role": role, "content": content} for role, content in self]
+
+
+def as_prompt(messages, system: Optional[str] = None) -> PromptView:
+    if isinstance(messages, PromptView):
+        return messages.with_system(system) if system else messages
+    return PromptView(messages, system=system)
+
+
+# KONVERSATION - VÄXER INKREMENTELLT, DELAS MELLAN SESSIONER
+class Conversation:
+    __slots__ = ("conversation_id", "_messages", "__weakref__")
+
+    def __init__(self, conversation_id: Optional[str] = None, messages: Iterable[Message] = ()):
+        self.conversation_id = conversation_id
+        self._messages = list(messages)
+
+    @classmethod
+    def from_rows(cls, conversation_id: str, rows: Iterable[dict]) -> "Conversation":
+        return cls(conversation_id, (Message(r["role"], r["content"], r.get("timestamp"), r.get("id")) for r in rows))
+
+    def add(self, role: str, content: str, timestamp: Optional[str] = None, id: Optional[int] = None) -> Message:
+        message = Message(role, content, timestamp, id)
+        self._messages.append(message)
+        return message
+
+    def append(self, message: Message) -> None:
+        self._messages.append(message)
+
+    # Ny lista i stället för att tömma den gamla, så att befintliga vyer behåller sitt innehåll
+    def clear(self) -> None:
+        self._messages = []
+
+    def prompt_view(self, system: Optional[str] = None) -> PromptView:
+        return PromptView(self._messages, system=system)
+
+    def to_dicts(self) -> list:
+        return [m.to_dict() for m in self._messages]
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def __iter__(self):
+        return iter(self._messages)
+
+    def __getitem__(self, index):
+        return self._messages[index]
+
+
+# DELAT LAGER - EN KONVERSATION I MINNET OAVSETT ANTAL SESSIONER
+class ConversationStore:
+
+    def __init__(self):
+        # Svaga referenser: en konversation lever så länge någon session håller i den
+        self._conversations = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    def load(self, conn, db_path: str, conversation_id: str) -> Conversation:
+        key = (db_path, conversation_id)
+        conversation = self._conversations.get(key)
+        if conversation is not None:
+            return conversation
+        loaded = Conversation.from_rows(conversation_id, load_messages(conn, conversation_id))
+        with self._lock:
+            return self._conversations.setdefault(key, loaded)
+
+    def new(self, db_path: str, conversation_id: str) -> Conversation:
+        conversation = Conversation(conversation_id)
+        with self._lock:
+            self._conversations[(db_path, conversation_id)] = conversation
+        return conversation
+
+    def forget(self, db_path: str, conversation_id: str) -> None:
+        with self._lock:
+            self._conversations.pop((db_path, conversation_id), None)
+
+    def __len__(self) -> int:
+        return len(self._conversations)
+
+
+CONVERSATIONS = ConversationStore()
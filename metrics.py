@@ -0,0 +1,241 @@
+# IMPORTER
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+DB_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# METRIKER - COUNTER, GAUGE & HISTOGRAM
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+    def _samples(self):
+        return []
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple, float] = {}
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    # Värdet räknas fram vid varje skrapning (endast för gauges utan labels)
+    def set_function(self, function: Callable[[], float]) -> None:
+        self._function = function
+
+    def _samples(self):
+        if self._function is not None:
+            return [f"{self.name} {_format_value(self._function())}"]
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # [räknare per bucket + Inf, summa, antal]
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def _samples(self):
+        with self._lock:
+            items = [(k, (list(s[0]), s[1], s[2])) for k, s in self._series.items()]
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+# REGISTER - PROCESSGEMENSAMMA METRIKER
+class Registry:
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._get_or_create(Counter, name, help_text, labelnames)
+
+    def gauge(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, help_text, labelnames)
+
+    def histogram(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, help_text, labelnames, buckets=buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(m.render() for m in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+# source skiljer anrop som användaren väntar på ("user") från förhämtningar i bakgrunden ("prefetch")
+LLM_REQUESTS = REGISTRY.counter("aichat_llm_requests_total", "LLM-anrop per modell, status och källa.", ("model", "status", "source"))
+LLM_LATENCY = REGISTRY.histogram("aichat_llm_request_duration_seconds", "Total svarstid för LLM-anrop.", ("model", "source"))
+LLM_TTFT = REGISTRY.histogram("aichat_llm_time_to_first_token_seconds", "Tid till första token.", ("model", "source"))
+LLM_TOKENS = REGISTRY.counter("aichat_llm_tokens_total", "Förbrukade tokens per modell, typ och källa.", ("model", "kind", "source"))
+DB_QUERY_LATENCY = REGISTRY.histogram("aichat_db_query_duration_seconds", "Tid per anrop i feedback_db.", ("function",), buckets=DB_BUCKETS)
+FEEDBACK_EVENTS = REGISTRY.counter("aichat_feedback_total", "Sparad eller ändrad feedback.", ("rating_type", "rating_value"))
+ACTIVE_SESSIONS = REGISTRY.gauge("aichat_active_sessions", "Sessioner med aktivitet inom SESSION_TTL.")
+
+
+# SESSIONER - AKTIVITET
+SESSION_TTL = 300.0
+SESSION_PRUNE_INTERVAL = 30.0
+_sessions: Dict[str, float] = {}
+_sessions_lock = threading.Lock()
+_last_prune = 0.0
+
+
+def _prune_sessions(now: float) -> None:
+    # Anropas med _sessions_lock hållet
+    global _last_prune
+    cutoff = now - SESSION_TTL
+    for session_id in [s for s, seen in _sessions.items() if seen < cutoff]:
+        del _sessions[session_id]
+    _last_prune = now
+
+
+# Rensar även här, inte bara vid skrapning, så att tabellen inte växer när ingen skrapar (metrics avstängt)
+def touch_session(session_id: str) -> None:
+    now = time.monotonic()
+    with _sessions_lock:
+        _sessions[session_id] = now
+        if now - _last_prune >= SESSION_PRUNE_INTERVAL:
+            _prune_sessions(now)
+
+
+def _count_active_sessions() -> int:
+    with _sessions_lock:
+        _prune_sessions(time.monotonic())
+        return len(_sessions)
+
+
+ACTIVE_SESSIONS.set_function(_count_active_sessions)
+
+
+# HTTP - TEXTFORMAT FÖR SKRAPARE
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server: Optional[ThreadingHTTPServer] = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+        return _server
@@ -0,0 +1,74 @@
+# IMPORTER
+import re
+from typing import Dict, Any
+
+from config import Config
+from metrics import REGISTRY
+
+AUTO_MODEL = "Auto"
+
+ROUTER_DECISIONS = REGISTRY.counter("aichat_router_decisions_total", "Routingbeslut per vald modell.", ("model",))
+
+# VIKTER - ENKLA, LOKALA SIGNALER
+DIFFICULTY_WEIGHTS = {"Lätt": 0.0, "Medel": 0.1, "Svår": 0.3}
+SUBJECT_WEIGHTS = {"Matematik": 0.1, "Programmering": 0.05, "Dataanalys": 0.05}
+CODE_PATTERN = re.compile(r"```|^\s*(def|class|import|for|while|if|return|SELECT|function)\b|[{};]\s*$|=>", re.M | re.I)
+REASONING_WORDS = ("bevisa", "härled", "varför", "jämför", "analysera", "optimera", "felsök", "debugga", "komplexitet", "steg för steg")
+
+
+def extract_features(message: str, subject: str, difficulty: str, history_length: int) -> Dict[str, Any]:
+    # Samma standardvärden som prompt.build_system_prompt
+    text = message or ""
+    lowered = text.lower()
+    return {
+        "chars": len(text),
+        "has_code": bool(CODE_PATTERN.search(text)),
+        "reasoning": any(word in lowered for word in REASONING_WORDS),
+        "subject": subject or "Allmänt",
+        "difficulty": difficulty or "Medel",
+        "history_length": history_length,
+    }
+
+
+def score_turn(features: Dict[str, Any]) -> float:
+    score = min(features["chars"] / 600, 1.0) * 0.3
+    if features["has_code"]:
+        score += 0.25
+    if features["reasoning"]:
+        score += 0.15
+    score += DIFFICULTY_WEIGHTS.get(features["difficulty"], 0.1)
+    score += SUBJECT_WEIGHTS.get(features["subject"], 0.0)
+    score += min(features["history_length"] / 20, 1.0) * 0.15
+    return round(min(score, 1.0), 3)
+
+
+# ROUTER - VÄLJ MODELL PER TUR
+# record=False för hypotetiska beslut (t.ex. förhämtning) som inte ska räknas i metrikerna
+def route_turn(message: str, subject: str, difficulty: str, history_length: int, threshold: float = None, record: bool = True) -> Dict[str, Any]:
+    threshold = Config.ROUTER_THRESHOLD if threshold is None else threshold
+    features = extract_features(message, subject, difficulty, history_length)
+    score = score_turn(features)
+    model = Config.ROUTER_STRONG_MODEL if score >= threshold else Config.ROUTER_FAST_MODEL
+    routing = {
+        "model": model,
+        "score": score,
+        "threshold": threshold,
+        "features": features,
+    }
+    if record:
+        record_decision(routing)
+    return routing
+
+
+def record_decision(routing: Dict[str, Any]) -> None:
+    ROUTER_DECISIONS.inc(model=routing["model"])
+
+
+# Gemensam ingång för appen och API:t; manuella val får samma signaler så att tröskeln kan jämföras mot dem
+def resolve_route(selected_model: str, message: str, subject: str, difficulty: str, history_length: int, record: bool = True) -> Dict[str, Any]:
+    if selected_model == AUTO_MODEL:
+        routing = route_turn(message, subject, difficulty, history_length, record=record)
+        routing["mode"] = "auto"
+        return routing
+    features = extract_features(message, subject, difficulty, history_length)
+    return {"mode": "manual", "model": selected_model, "score": score_turn(features), "features": features}
@@ -0,0 +1,158 @@
+# IMPORTER
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional
+
+from config import Config
+from metrics import REGISTRY
+
+PREFETCH_EVENTS = REGISTRY.counter("aichat_prefetch_total", "Utfall för förhämtade följdfrågor.", ("subject", "outcome"))
+PREFETCH_TOKENS = REGISTRY.counter("aichat_prefetch_tokens_total", "Tokens för förhämtning, använda eller slösade.", ("subject", "outcome"))
+
+# FÖLJDFRÅGOR - BILLIGA, LOKALA FÖRSLAG
+GENERIC_FOLLOW_UPS = ["Ge ett till exempel.", "Förklara enklare.", "Hur används detta i praktiken?"]
+SUBJECT_FOLLOW_UPS = {
+    "Programmering": "Visa ett kort kodexempel.",
+    "Matematik": "Visa lösningen steg för steg.",
+    "Språk": "Ge några exempelmeningar.",
+    "Dataanalys": "Visa ett exempel med en liten datamängd.",
+}
+
+
+def propose_follow_ups(subject: str, difficulty: str, limit: int = 3) -> List[str]:
+    questions = []
+    if subject in SUBJECT_FOLLOW_UPS:
+        questions.append(SUBJECT_FOLLOW_UPS[subject])
+    questions.extend(q for q in GENERIC_FOLLOW_UPS if not (difficulty == "Lätt" and q == "Förklara enklare."))
+    return questions[:limit]
+
+
+def prefetch_enabled(subject: str) -> bool:
+    return Config.ENABLE_PREFETCH and subject not in Config.PREFETCH_DISABLED_SUBJECTS
+
+
+# Samma hash som LLMHandler sätter som prompt_prefix_hash
+def prompt_hash(system_message: Optional[str]) -> str:
+    return hashlib.sha1((system_message or "").encode("utf-8")).hexdigest()[:12]
+
+
+def _tokens_of(result: Optional[Dict[str, Any]]) -> int:
+    if not result:
+        return 0
+    total = (result.get("debug", {}).get("token_usage") or {}).get("total_tokens")
+    if isinstance(total, int):
+        return total
+    # Uppskattning när leverantören inte rapporterar användning
+    return len(result.get("text", "")) // 4
+
+
+# Delad bakgrundsexekutor; få arbetare så att förhämtning aldrig tränger undan riktiga anrop
+_executor = ThreadPoolExecutor(max_workers=Config.PREFETCH_WORKERS, thread_name_prefix="prefetch")
+
+
+# PREFETCHER - PER SESSION
+class FollowUpPrefetcher:
+
+    def __init__(self, token_budget: int = None):
+        self.token_budget = Config.PREFETCH_TOKEN_BUDGET if token_budget is None else token_budget
+        self.tokens_used = 0
+        self.stats = {"hits": 0, "misses": 0, "wasted": 0, "used_tokens": 0, "wasted_tokens": 0}
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    # models: vilken modell varje följdfråga skulle skickas till (kan skilja sig under Auto)
+    def schedule(self, llm_handler, *, questions: List[str], history: list, system_message: str, models: Dict[str, str], temperature: float, subject: str) -> None:
+        self.discard()
+        for question in questions:
+            future = _executor.submit(
+                self._generate,
+                llm_handler,
+                history + [{"role": "user", "content": question}],
+                system_message,
+                models[question],
+                temperature,
+            )
+            self._entries[question] = {
+                "future": future,
+                "history_length": len(history),
+                "subject": subject,
+                "prompt_hash": prompt_hash(system_message),
+                "model": models[question],
+                "temperature": temperature,
+            }
+
+    def _generate(self, llm_handler, messages: list, system_message: str, model_name: str, temperature: float) -> Optional[Dict[str, Any]]:
+        # Budgeten kontrolleras när jobbet faktiskt startar, inte när det köas
+        with self._lock:
+            if self.tokens_used >= self.token_budget:
+                return None
+        result = None
+        for event in llm_handler.stream(messages, system_message=system_message, model_name=model_name, temperature=temperature, source="prefetch"):
+            if event["type"] in ("done", "error"):
+                result = event
+        with self._lock:
+            self.tokens_used += _tokens_of(result)
+        return result
+
+    # Returnerar ett färdigt svar om följdfrågan förhämtades för exakt denna historik,
+    # systemprompt, modell och temperatur; annars räknas klicket som en miss
+    def take(self, question: str, history_length: int, *, system_message: str, model_name: str, temperature: float) -> Optional[Dict[str, Any]]:
+        entry = self._entries.pop(question, None)
+        subject = entry["subject"] if entry else ""
+        result = None
+        matches = entry is not None and (
+            entry["history_length"] == history_length
+            and entry["prompt_hash"] == prompt_hash(system_message)
+            and entry["model"] == model_name
+            and entry["temperature"] == temperature
+        )
+        if entry and not matches:
+            self._drop(entry)
+        elif matches:
+            future = entry["future"]
+            if future.cancel():
+                result = None
+            else:
+                # Redan startad: att vänta in den är billigare än att starta ett nytt anrop
+                result = future.result()
+        with self._lock:
+            if result and result["type"] == "done":
+                self.stats["hits"] += 1
+                self.stats["used_tokens"] += _tokens_of(result)
+                PREFETCH_EVENTS.inc(subject=subject, outcome="hit")
+                PREFETCH_TOKENS.inc(_tokens_of(result), subject=subject, outcome="used")
+                return result
+            self.stats["misses"] += 1
+            PREFETCH_EVENTS.inc(subject=subject, outcome="miss")
+            return None
+
+    # Oanvända förhämtningar: köade avbryts, startade räknas som slöseri när de blir klara
+    def discard(self) -> None:
+        entries, self._entries = self._entries, {}
+        for entry in entries.values():
+            self._drop(entry)
+
+    def _drop(self, entry: Dict[str, Any]) -> None:
+        if entry["future"].cancel():
+            return
+        entry["future"].add_done_callback(lambda f, subject=entry["subject"]: self._count_wasted(f, subject))
+
+    def _count_wasted(self, future, subject: str) -> None:
+        if future.cancelled() or future.exception() is not None or future.result() is None:
+            return
+        tokens = _tokens_of(future.result())
+        with self._lock:
+            self.stats["wasted"] += 1
+            self.stats["wasted_tokens"] += tokens
+        PREFETCH_EVENTS.inc(subject=subject, outcome="wasted")
+        PREFETCH_TOKENS.inc(tokens, subject=subject, outcome="wasted")
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["tokens_used"] = self.tokens_used
+            stats["token_budget"] = self.token_budget
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else None
+        return stats
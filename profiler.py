@@ -0,0 +1,199 @@
+# IMPORTER
+import cProfile
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+from config import Config
+
+# Aktiv körning per tråd (Streamlit kör varje session i sin egen skripttråd)
+_local = threading.local()
+
+
+def _current_trace() -> Optional["RerunTrace"]:
+    return getattr(_local, "trace", None)
+
+
+# RERUNTRACE - EN KÖRNING AV SKRIPTET
+class RerunTrace:
+
+    def __init__(self):
+        self.started_at = datetime.now().isoformat(timespec="seconds")
+        self._start = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.depths: Dict[str, int] = {}
+        self.queries: List[Dict[str, Any]] = []
+        self.total: Optional[float] = None
+        self.completed = False
+        self._stack: List[str] = []
+        self._open_query: Optional[Dict[str, Any]] = None
+
+    def push(self, name: str) -> str:
+        self._stack.append(name)
+        return " / ".join(self._stack)
+
+    def pop(self, path: str, seconds: float) -> None:
+        self.close_query()
+        self._stack.pop()
+        self.phases[path] = self.phases.get(path, 0.0) + seconds
+        self.depths[path] = path.count(" / ")
+
+    # SQLite-tracen ger bara starten av varje sats; tiden räknas fram till nästa sats eller spangräns
+    def on_statement(self, sql: str) -> None:
+        now = time.perf_counter()
+        self.close_query(now)
+        self._open_query = {
+            "sql": " ".join(sql.split())[:200],
+            "span": " / ".join(self._stack) or "-",
+            "start": now,
+        }
+
+    def close_query(self, now: float = None) -> None:
+        query = self._open_query
+        if query is None:
+            return
+        now = now or time.perf_counter()
+        self.queries.append({
+            "sql": query["sql"],
+            "span": query["span"],
+            "duration": now - query["start"],
+        })
+        self._open_query = None
+
+    def finish(self, completed: bool = True) -> None:
+        self.close_query()
+        self.total = time.perf_counter() - self._start
+        self.completed = completed
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "started_at": self.started_at,
+            "total": self.total,
+            "completed": self.completed,
+            "phases": dict(self.phases),
+            "depths": dict(self.depths),
+            "queries": list(self.queries),
+        }
+
+
+# SPANS - NAMNGIVNA FASER
+@contextmanager
+def span(name: str):
+    trace = _current_trace()
+    if trace is None:
+        yield
+        return
+    path = trace.push(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.pop(path, time.perf_counter() - start)
+
+
+def _trace_statement(sql: str) -> None:
+    trace = _current_trace()
+    if trace is not None:
+        trace.on_statement(sql)
+
+
+def install_query_tracer(conn) -> None:
+    conn.set_trace_callback(_trace_statement)
+
+
+# SAMPLINGPROFILER - STACKAR FRÅN EN TRÅD
+class SamplingProfiler:
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    # Format: "folded stacks", läsbart av flamegraph.pl och speedscope
+    def dump(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+# PERFTRACKER - HISTORIK ÖVER KÖRNINGAR
+class PerfTracker:
+
+    def __init__(self, history_size: int = 20):
+        self.history = deque(maxlen=history_size)
+        self._trace: Optional[RerunTrace] = None
+        self._profiler = None
+
+    # st.stop()/st.rerun() avbryter skriptet, så en ofullständig körning stängs vid nästa start
+    def start_rerun(self) -> None:
+        if self._trace is not None:
+            self._finish(completed=False)
+        self._trace = RerunTrace()
+        _local.trace = self._trace
+        self._start_profiler()
+
+    def finish_rerun(self) -> None:
+        if self._trace is not None:
+            self._finish(completed=True)
+
+    def _finish(self, completed: bool) -> None:
+        self._stop_profiler()
+        self._trace.finish(completed=completed)
+        self.history.append(self._trace.summary())
+        if _current_trace() is self._trace:
+            _local.trace = None
+        self._trace = None
+
+    def _start_profiler(self) -> None:
+        mode = Config.PROFILE_MODE
+        try:
+            if mode == "cprofile":
+                self._profiler = cProfile.Profile()
+                self._profiler.enable()
+            elif mode == "sampling":
+                self._profiler = SamplingProfiler(threading.get_ident(), Config.PROFILE_SAMPLE_INTERVAL)
+                self._profiler.start()
+        except ValueError:
+            # En annan profilerare är redan aktiv i processen (t.ex. en parallell session)
+            self._profiler = None
+
+    def _stop_profiler(self) -> None:
+        profiler, self._profiler = self._profiler, None
+        if profiler is None:
+            return
+        os.makedirs(Config.PROFILE_DIR, exist_ok=True)
+        stamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S_%f")
+        if isinstance(profiler, cProfile.Profile):
+            profiler.disable()
+            profiler.dump_stats(os.path.join(Config.PROFILE_DIR, f"rerun_{stamp}.prof"))
+        else:
+            profiler.stop()
+            profiler.dump(os.path.join(Config.PROFILE_DIR, f"rerun_{stamp}.folded"))
+
+    def get_history(self, limit: int = 10) -> List[Dict[str, Any]]:
+        return list(self.history)[-limit:]
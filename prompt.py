@@ -1,23 +1,35 @@
 # IMPORTER
+from functools import lru_cache
 from typing import Dict, Optional
 
+# PROMPT-LAGER - STABIL PREFIX FÖRST
+# Ordningen är viktig för leverantörens prefix-cache: statiska instruktioner, sedan ämnestext,
+# sedan flyktiga tips och sist historiken. Ändra aldrig STATIC_INSTRUCTIONS per anrop.
+STATIC_INSTRUCTIONS = (
+    "Du är en pedagogisk handledare. "
+    "Svara på svenska och håll dig konkret och hjälpsam. "
+    "Ge korta, begripliga förklaringar och 1-2 enkla exempel. "
+    "Belys nyckelgrepp tydligt."
+)
+
+FEEDBACK_HINT_CLEARER = "Var extra tydlig, konkret och undvik vaga formuleringar."
+FEEDBACK_HINT_KEEP = "Behåll den tydliga och hjälpsamma tonen."
+
 # PROMPT-BUILDER - SYSTEMPROMPTS
+@lru_cache(maxsize=64)
 def build_system_prompt(subject: str, difficulty: str) -> str:
     subject = subject or "Allmänt"
     difficulty = difficulty or "Medel"
+    return f"{STATIC_INSTRUCTIONS} Ämne: {subject}. Nivå: {difficulty}."
 
-    base = (
-        f"Ämne: {subject}. Nivå: {difficulty}."
-        f"Svara på svenska och håll dig konkret och hjälpsam"
-    )
-
-    style = (
-        "Du är en pedagogisk handledare."
-        "Ge korta, begripliga förklaringar och 1-2 enkla exempel."
-        "Belys nyckelgrepp tydligt."
-    )
-
-    return f"{base} {style}"
+def get_feedback_hint(feedback_summary: Optional[Dict] = None) -> str:
+    if not feedback_summary:
+        return ""
+    if feedback_summary.get("down", 0) > feedback_summary.get("up", 0):
+        return FEEDBACK_HINT_CLEARER
+    if feedback_summary.get("up", 0) > 0:
+        return FEEDBACK_HINT_KEEP
+    return ""
 
 # PROMPT-SELECTOR - SYSTEMPROMPT MED FEEDBACK
 def get_system_prompt(
@@ -25,18 +37,18 @@ def get_system_prompt(
     saved_prompts: Dict = None,
     subject: str = "Programmering",
     difficulty: str = "Medel",
-    feedback_summary: Optional[Dict] = None
+    feedback_summary: Optional[Dict] = None,
+    feedback_hint: Optional[str] = None
 ) -> str:
     saved_prompts = saved_prompts or {}
-    
+
     if selected_saved_prompt != "Ingen prompt vald" and selected_saved_prompt in saved_prompts:
-        return saved_prompts[selected_saved_prompt]['content']
+        saved = saved_prompts[selected_saved_prompt]
+        # Kompilerade mallar från prompt_registry fyller i {subject}/{difficulty}
+        if hasattr(saved, "render"):
+            return saved.render(subject or "Allmänt", difficulty or "Medel")
+        return saved['content']
     else:
         base = build_system_prompt(subject=subject, difficulty=difficulty)
-        if feedback_summary:
-            if feedback_summary.get("down", 0) > feedback_summary.get("up", 0):
-                base += " Var extra tydlig, konkret och undvik vaga formuleringar."
-            elif feedback_summary.get("up", 0) > 0:
-                base += " Behåll den tydliga och hjälpsamma tonen."
-        return base
-
+        hint = feedback_hint if feedback_hint is not None else get_feedback_hint(feedback_summary)
+        return f"{base} {hint}" if hint else base
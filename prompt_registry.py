@@ -0,0 +1,76 @@
+# IMPORTER
+import re
+import threading
+from typing import Dict, List, Optional
+
+from feedback_db import get_all_prompts, get_prompts_version
+
+# Endast dessa platshållare ersätts; övriga klamrar (t.ex. i kodexempel) lämnas orörda
+PLACEHOLDER_PATTERN = re.compile(r"\{(subject|difficulty)\}")
+
+
+# KOMPILERAD PROMPT - MALL MED PLATSHÅLLARE
+class CompiledPrompt:
+
+    def __init__(self, name: str, content: str, description: str = ""):
+        self.name = name
+        self.content = content
+        self.description = description
+        # Växlande [text, fält, text, fält, ...] från re.split med en fångande grupp
+        self.segments = PLACEHOLDER_PATTERN.split(content)
+        self._rendered: Dict[tuple, str] = {}
+
+    @property
+    def has_placeholders(self) -> bool:
+        return len(self.segments) > 1
+
+    # Samma (ämne, nivå) ger alltid samma strängobjekt, så texten är identisk mellan anrop
+    def render(self, subject: str, difficulty: str) -> str:
+        if not self.has_placeholders:
+            return self.content
+        key = (subject, difficulty)
+        text = self._rendered.get(key)
+        if text is None:
+            values = {"subject": subject, "difficulty": difficulty}
+            text = "".join(values[part] if i % 2 else part for i, part in enumerate(self.segments))
+            self._rendered[key] = text
+        return text
+
+
+# REGISTER - DELAS AV ALLA SESSIONER I PROCESSEN
+class PromptRegistry:
+
+    def __init__(self):
+        self._version: Optional[int] = None
+        self._prompts: Dict[str, CompiledPrompt] = {}
+        self._lock = threading.Lock()
+
+    # En billig versionskontroll per anrop; full omladdning bara när något har ändrats
+    def refresh(self, conn) -> None:
+        version = get_prompts_version(conn)
+        if version == self._version:
+            return
+        with self._lock:
+            if version == self._version:
+                return
+            previous = self._prompts
+            prompts = {}
+            for p in get_all_prompts(conn):
+                existing = previous.get(p["name"])
+                if existing is not None and existing.content == p["content"]:
+                    existing.description = p["description"]
+                    prompts[p["name"]] = existing
+                else:
+                    prompts[p["name"]] = CompiledPrompt(p["name"], p["content"], p["description"])
+            self._prompts = prompts
+            self._version = version
+
+    def prompts(self, conn) -> Dict[str, CompiledPrompt]:
+        self.refresh(conn)
+        return self._prompts
+
+    def names(self, conn) -> List[str]:
+        return list(self.prompts(conn))
+
+    def get(self, conn, name: str) -> Optional[CompiledPrompt]:
+        return self.prompts(conn).get(name)
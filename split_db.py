@@ -0,0 +1,40 @@
+# IMPORTER
+import argparse
+import csv
+
+from feedback_db import ShardRouter, split_database
+
+
+def load_mapping(path: str) -> dict:
+    # CSV med kolumnerna conversation_id,tenant (rubrikrad valfri)
+    mapping = {}
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.reader(f):
+            if len(row) < 2 or row[0] == "conversation_id":
+                continue
+            mapping[row[0].strip()] = row[1].strip()
+    return mapping
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Dela upp en befintlig feedback.db i en SQLite-fil per hyresgäst.")
+    parser.add_argument("source", help="Sökväg till den monolitiska databasen.")
+    parser.add_argument("--shard-dir", required=True, help="Katalog där shard-filerna skapas.")
+    parser.add_argument("--mapping", help="CSV med conversation_id,tenant.")
+    parser.add_argument("--default-tenant", default="default", help="Hyresgäst för konversationer som saknas i mappningen.")
+    args = parser.parse_args()
+
+    mapping = load_mapping(args.mapping) if args.mapping else {}
+    router = ShardRouter(shard_dir=args.shard_dir)
+    try:
+        counts = split_database(args.source, router, mapping, args.default_tenant)
+    except ValueError as e:
+        parser.error(str(e))
+
+    for tenant, tables in sorted(counts.items()):
+        summary = ", ".join(f"{table}={n}" for table, n in tables.items())
+        print(f"{tenant}: {summary}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,24 @@
 # IMPORTER
 import uuid
 import streamlit as st
-from feedback_db import get_all_conversations, load_messages, delete_conversation
+from feedback_db import get_all_conversations, delete_conversation
+from message_store import CONVERSATIONS
+from profiler import span
+
+# Förhämtade följdfrågor hör till den gamla konversationen; avbryt dem och räkna startade som slöseri
+def reset_follow_ups() -> None:
+    prefetcher = st.session_state.get("prefetcher")
+    if prefetcher is not None:
+        prefetcher.discard()
+    st.session_state.follow_ups = []
 
 # SIDOPANEL - KONVERSATIONER
 
 def render_conversations_sidebar(db_conn) -> None:
     st.subheader("Konversationer")
     try:
-        conversations = get_all_conversations(db_conn)
+        with span("db:get_all_conversations"):
+            conversations = get_all_conversations(db_conn)
         if conversations:
             conv_options = [f"{conv['id'][:8]}... ({conv['updated_at'][:10]})" for conv in conversations]
             conv_options.insert(0, "Ny konversation")
@@ -21,20 +31,23 @@ def render_conversations_sidebar(db_conn) -> None:
                     st.error("Fel vid val av konversation.")
                     return
                 if st.button("Ladda konversation", key="load_conv"):
+                    reset_follow_ups()
                     st.session_state.conversation_id = selected_id
-                    messages = load_messages(db_conn, selected_id)
-                    st.session_state.messages = messages if messages else []
+                    st.session_state.messages = CONVERSATIONS.load(db_conn, st.session_state.db_path, selected_id)
                     st.rerun()
                 if st.button("Ta bort konversation", key="delete_conv"):
                     delete_conversation(db_conn, selected_id)
+                    CONVERSATIONS.forget(st.session_state.db_path, selected_id)
                     if st.session_state.conversation_id == selected_id:
+                        reset_follow_ups()
                         st.session_state.conversation_id = str(uuid.uuid4())
-                        st.session_state.messages = []
+                        st.session_state.messages = CONVERSATIONS.new(st.session_state.db_path, st.session_state.conversation_id)
                     st.rerun()
             else:
                 if st.button("Starta ny konversation", key="new_conv"):
+                    reset_follow_ups()
                     st.session_state.conversation_id = str(uuid.uuid4())
-                    st.session_state.messages = []
+                    st.session_state.messages = CONVERSATIONS.new(st.session_state.db_path, st.session_state.conversation_id)
                     st.rerun()
         else:
             st.info("Inga konversationer än. Starta en ny chatt!")